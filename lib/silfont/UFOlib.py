@@ -7,7 +7,7 @@ __author__ = 'David Raymond'
 __version__ = '1.0.0'
 
 from xml.etree import cElementTree as ET
-import sys, os, copy, shutil, filecmp
+import sys, os, re, copy, shutil, filecmp, datetime, base64, plistlib
 import collections
 from silfont.genlib import *
 
@@ -38,6 +38,13 @@ for i in range(0,32) : _illegalChars += chr(i)
 _illegalChars = list(_illegalChars)
 _reservedNames = "CON PRN AUX CLOCK$ NUL COM1 COM2 COM3 COM4 PT1 LPT2 LPT3".lower().split(" ")
 
+_kernPrefixes = ("public.kern1.", "public.kern2.") # UFO 3 kerning group name prefixes
+_kernPrefixesUFO2 = ("@MMK_L_", "@MMK_R_") # Used when naming kerning groups for UFO 2, following MetricsMachine
+
+# Tokens in features.fea: comments, strings, class names and numbers (which are skipped), closing braces and names
+_feaTokens = re.compile(r'(#[^\n]*|"[^"]*"|@[\w.\-]+|\d[\w.\-]*)|(})|(\\?)([A-Za-z_.][\w.\-]*)')
+_feaLabelKeywords = set(("lookup", "feature", "script", "language", "languagesystem", "table")) # Followed by non-glyph names
+
 class _Ucontainer(object) :
     # Parent class for other objects (eg Ulayer)
     def __init_(self) :
@@ -50,14 +57,25 @@ class _Ucontainer(object) :
         return self._contents[key]
     def __iter__(self):
         return iter(self._contents)
+    def __contains__(self, key):
+        return key in self._contents
     def keys(self) :
         return self._contents.keys()
 
 class _plist(object) :
     # Used for common plist methods inherited by Uplist and Ulib classes
+    # Removing items from the etree one at a time means scanning the dict element each time, so removed items are
+    # just dropped from _contents and listed in _removed, then taken out of the etree in one pass by syncET()
+    # Native plists (see Uplist) hold python values in _contents instead of [keyelem, valelem] pairs, so plist[key]
+    # returns a python value for them (currently font.groups and font.kerning) but a [keyelem, valelem] pair for other
+    # plists, eg font.lib and font.fontinfo.  getnative() and setnative() work the same way for both.
+    native = False
 
     def addval(self,key,valuetype,value) : # For simple single-value elements
         if key in self._contents : self.font.logger.log("Attempt to add duplicate key " + key + " to plist", "X")
+        if self.native :
+            self._contents[key] = _plistValue(valuetype, value)
+            return
         dict = self.etree[0]
 
         keyelem = ET.Element("key")
@@ -71,19 +89,44 @@ class _plist(object) :
         self._contents[key] = [keyelem,valelem]
 
     def setval(self,key,valuetype,value) :
-        if key in self._contents :
+        if key in self._contents and not self.native :
             self._contents[key][1].text = value
         else :
+            if key in self._contents : del self._contents[key]
             self.addval(key,valuetype,value)
 
     def remove(self,key) :
-        item = self._contents[key]
-        self.etree[0].remove(item[0])
-        self.etree[0].remove(item[1])
-        del self._contents[key]
+        if self.native :
+            del self._contents[key]
+        else :
+            self._removed.append(self._contents.pop(key))
+
+    def getnative(self,key) : # Return the value for key as a python value (see plistValue)
+        return self._contents[key] if self.native else plistValue(self._contents[key][1])
+
+    def setnative(self,key,value) : # Set key from a python value (see plistElement), so scripts don't need to build elements
+        if self.native :
+            self._contents[key] = value
+        else :
+            self.setelem(key,plistElement(value))
+
+    def syncET(self) : # Remove items from the etree that have been removed from _contents; needed before the etree is used
+        if self.native : # Build a new etree from the values
+            self.etree = ET.Element("plist", self._rootattrib)
+            self.etree.append(plistElement(self._contents))
+            return
+        if not self._removed : return
+        removed = set()
+        for item in self._removed : removed.update((id(item[0]), id(item[1])))
+        dict = self.etree[0]
+        dict[:] = [elem for elem in dict if id(elem) not in removed]
+        self._removed = []
 
     def addelem(self,key,element) : # For non-simple elements (eg arrays) the calling script needs to build the etree element
         if key in self._contents : self.font.logger.log("Attempt to add duplicate key " + key + " to plist", "X")
+        if self.native :
+            self._contents[key] = plistValue(element)
+            return
         dict = self.etree[0]
 
         keyelem = ET.Element("key")
@@ -142,18 +185,46 @@ class UtextFile(object) :
         dtree[filen].setinfo(read = True)
         dtree[filen].fileObject = self
         dtree[filen].fileType = "text"
+        self.text = None # Only set, by settext(), if the text is changed
+
+    def gettext(self) :
+        if self.text is not None : return self.text
+        inpath = os.path.join(self.dirn,self.filen)
+        if not os.path.exists(inpath) : return ""
+        inf = open(inpath, "r")
+        text = inf.read()
+        inf.close()
+        return text
+
+    def settext(self, text) :
+        self.text = text
 
     def write(self, dtreeitem, dir, ofilen, exists) :
-        # For now just copies source to destination if changed
+        # Copies source to destination if changed, unless the text has been changed by settext()
         inpath = os.path.join(self.dirn,self.filen)
+        outpath = os.path.join(dir,self.filen)
         changed = True
-        if exists : changed = not (filecmp.cmp(inpath, os.path.join(dir,self.filen)))
-        if changed :
-            try :
-                shutil.copy2(inpath, dir)
-            except Exception as e :
-                print e
-                sys.exit(1)
+        if self.text is not None :
+            if exists :
+                outf = open(outpath, "r")
+                changed = outf.read() <> self.text
+                outf.close()
+            if changed :
+                try :
+                    outf = open(outpath, "w")
+                    outf.write(self.text)
+                    outf.close()
+                except Exception as e :
+                    print e
+                    sys.exit(1)
+        else :
+            if exists : changed = not (filecmp.cmp(inpath, outpath))
+            if changed :
+                try :
+                    shutil.copy2(inpath, dir)
+                except Exception as e :
+                    print e
+                    sys.exit(1)
         dtreeitem.written = True
 
 class Ufont(object) :
@@ -229,8 +300,9 @@ class Ufont(object) :
 
             # Read other top-level plists
             if "fontinfo.plist" in self.dtree : self.fontinfo = self._readPlist("fontinfo.plist")
-            if "groups.plist" in self.dtree : self.groups = self._readPlist("groups.plist")
-            if "kerning.plist" in self.dtree : self.kerning = self._readPlist("kerning.plist")
+            # groups and kerning can be large and are simple structures, so are read as python values - see _plist
+            if "groups.plist" in self.dtree : self.groups = self._readPlist("groups.plist", native = True)
+            if "kerning.plist" in self.dtree : self.kerning = self._readPlist("kerning.plist", native = True)
             if self.UFOversion == "2" : # Create a dummy layer contents so 2 & 3 can be handled the same
                 if "glyphs" not in self.dtree : self.logger.log('No glyphs directory in font', "S")
                 self.layercontents = Uplist(font = self)
@@ -260,14 +332,55 @@ class Ufont(object) :
             ## Process other files and directories
 
 
-    def _readPlist(self, filen) :
+    def _readPlist(self, filen, native = False) :
         if filen in self.dtree :
-            plist = Uplist(font = self, filen = filen)
+            plist = Uplist(font = self, filen = filen, native = native)
             self.dtree[filen].setinfo(read = True, fileObject = plist, fileType = "xml")
             return plist
         else :
             self.logger.log( filen + " does not exist", "S")
 
+    def kerningIndex(self) :
+        # Return the Ukerning index of the font's kerning and groups, creating it when first needed
+        if self.__dict__.get("_kerningIndex") is None : self._kerningIndex = Ukerning(self)
+        return self._kerningIndex
+
+    def renameGlyphs(self, mapping) :
+        # Rename glyphs throughout the font from {old name: new name}: glyphs and component references in all layers,
+        # public.glyphOrder and public.postscriptNames in lib.plist, groups, kerning and glyph names in features.fea
+        # Names can be swapped or chained.  If any new name would clash with another glyph, nothing is renamed
+        mapping = dict((old, new) for (old, new) in mapping.iteritems() if old <> new)
+        errors = False
+        oldnames = {}
+        for (old, new) in sorted(mapping.iteritems()) :
+            if new in oldnames :
+                self.logger.log("Both " + oldnames[new] + " and " + old + " would be renamed to " + new, "E")
+                errors = True
+            oldnames[new] = old
+        for layer in self.layers :
+            for new in sorted(oldnames) :
+                if new in layer and new not in mapping :
+                    self.logger.log("Can't rename " + oldnames[new] + " to " + new + " since " + new + " is already in layer " + layer.layername, "E")
+                    errors = True
+        if errors : self.logger.log("Glyph renaming abandoned due to errors", "S")
+
+        for layer in self.layers :
+            count = layer.renameGlyphs(mapping)
+            self.logger.log(str(count) + " glyphs renamed in layer " + layer.layername, "I")
+        if "lib" in self.__dict__ :
+            if "public.glyphOrder" in self.lib :
+                glyphorder = self.lib.getnative("public.glyphOrder")
+                if any(glyphn in mapping for glyphn in glyphorder) :
+                    self.lib.setnative("public.glyphOrder", [mapping.get(glyphn, glyphn) for glyphn in glyphorder])
+            if "public.postscriptNames" in self.lib :
+                psnames = self.lib.getnative("public.postscriptNames")
+                if any(glyphn in mapping for glyphn in psnames) :
+                    self.lib.setnative("public.postscriptNames", collections.OrderedDict((mapping.get(glyphn, glyphn), psname) for glyphn, psname in psnames.iteritems()))
+        self.kerningIndex().renameGlyphs(mapping)
+        if "features" in self.__dict__ :
+            count = self.features.renameGlyphs(mapping)
+            self.logger.log(str(count) + " glyph names changed in features.fea", "I")
+
     def write(self, outdir) :
         # Write UFO out to disk, based on values set in self.outparams
         self.logger.log( "Processing font for output", "P")
@@ -329,6 +442,8 @@ class Ulayer(_Ucontainer) :
 
     def __init__(self, layername, layerdir, font) :
         self._contents = {}
+        self._compIndex = None # {component base: {glyph name: count}}, built on first use by componentUsers()
+        self._usvIndex = {} # {codepoint: [glyph names]}, see usvGlyphs()
         self.dtree = font.dtree.subTree(layerdir)
         font.dtree[layerdir].read = True
         self.layername = layername
@@ -352,6 +467,7 @@ class Ulayer(_Ucontainer) :
                 if glyph.name <> glyphn :
                     super(Uglif,glyph).__setattr__("name",glyphn) # Need to use super to bypass normal glyph renaming logic
                     self.font.logger.log( "Glyph names in glif and contents.plist did not match for " + glyphn + "; corrected", "W")
+                self._indexUnicodes(glyph, 1)
             else :
                 self.font.logger.log( "Missing glif " + glifn + " in " + fulldir, "S")
 
@@ -370,11 +486,11 @@ class Ulayer(_Ucontainer) :
             setFileForOutput(dtree,glyph.filen, glyph, "xml")
 
     def renameGlifs(self) :
-        namelist=[]
+        namelist = set()
         for glyphn in sorted(self.keys()) :
             glyph = self._contents[glyphn]
             filename = makeFileName(glyphn,namelist)
-            namelist.append(filename.lower())
+            namelist.add(filename.lower())
             filename += ".glif"
             if filename <> glyph.filen :
                 self.renameGlif(glyphn,glyph,filename)
@@ -400,23 +516,400 @@ class Ulayer(_Ucontainer) :
         # Add to contents.plist and dtree
         self.contents.addval(glyphn,"string",glifn)
         self.dtree[glifn] = dirTreeItem(read = False, added = True, fileObject = glyph, fileType = "xml")
+        self._indexComponents(glyph, 1)
+        self._indexUnicodes(glyph, 1)
 
     def delGlyph(self,glyphn) :
+        self._indexComponents(self[glyphn], -1)
+        self._indexUnicodes(self[glyphn], -1)
         self.dtree.removedfiles[self[glyphn].filen] = "deleted" # Track so original glif does not get reported as invalid
         del self._contents[glyphn]
         self.contents.remove(glyphn)
 
+    def renameGlyphs(self, mapping) :
+        # Rename glyphs from {old name: new name} in one pass, giving renamed glyphs new glif file names and updating
+        # component references in all glyphs.  Names can be swapped or chained (eg a to b and b to c), but new names
+        # must not clash with glyphs that are not renamed - Ufont.renameGlyphs() checks for that
+        # Returns the number of glyphs renamed
+        renamed = [(self._contents[glyphn], mapping[glyphn]) for glyphn in sorted(self._contents) if glyphn in mapping]
+        for glyph, newname in renamed :
+            self._indexUnicodes(glyph, -1)
+            del self._contents[glyph.name]
+            self.contents.remove(glyph.name)
+        # Glif names must be unique ignoring case, so start from those used by glyphs that are not being renamed
+        namelist = set(self.contents[glyphn][1].text.lower()[:-5] for glyphn in self.contents)
+        for glyph, newname in renamed :
+            super(Uglif,glyph).__setattr__("name",newname) # Bypass the normal one-at-a-time glyph renaming logic
+            glifn = makeFileName(newname, namelist)
+            namelist.add(glifn.lower())
+            glifn += ".glif"
+            self.contents.addval(newname,"string",glifn)
+            if glifn <> glyph.filen :
+                self.dtree.removedfiles[glyph.filen] = glifn # Track so original glif does not get reported as invalid
+                glyph.filen = glifn
+                self.dtree[glifn] = dirTreeItem(read = False, added = True, fileObject = glyph, fileType = "xml")
+            self._contents[newname] = glyph
+            self._indexUnicodes(glyph, 1)
+        for glyph in self._contents.itervalues() :
+            outline = glyph['outline']
+            if outline is None : continue
+            for comp in outline.components :
+                base = comp.element.get('base')
+                if base in mapping : comp.element.set('base', mapping[base])
+        self._compIndex = None # Rebuilt on next use of componentUsers()
+        return len(renamed)
+
+    def setLibValues(self, rows, keys = (), unmatched = None) :
+        # Set glyph lib values in one pass from rows of (glyph name, [(key, value), ...]), eg from a csv file
+        # A value is (valuetype, text) for simple values, a list or dict (see plistElement) or an element for other values,
+        # or None to remove the key
+        # keys lists the lib keys being managed, which are removed from glyphs that have no row
+        # unmatched, if supplied, is called with the glyph name for each row with no glyph in the layer, eg to log it
+        # Returns {glyph name: [keys removed]} for all glyphs that had no row
+        uncovered = set(self._contents)
+        for glyphn, libvals in rows :
+            glyph = self._contents.get(glyphn)
+            if glyph is None :
+                if unmatched : unmatched(glyphn)
+                continue
+            uncovered.discard(glyphn)
+            lib = glyph["lib"]
+            for key, value in libvals :
+                if value is None :
+                    if lib is not None and key in lib : lib.remove(key)
+                    continue
+                if lib is None :
+                    glyph.add("lib")
+                    lib = glyph["lib"]
+                if isinstance(value, tuple) :
+                    lib.setval(key, value[0], value[1])
+                elif isinstance(value, (list, dict)) :
+                    lib.setnative(key, value)
+                else :
+                    lib.setelem(key, value)
+        removed = {}
+        for glyphn in uncovered :
+            lib = self._contents[glyphn]["lib"]
+            removed[glyphn] = [key for key in keys if lib is not None and key in lib]
+            for key in removed[glyphn] : lib.remove(key)
+        return removed
+
+    def componentUsers(self,glyphn) :
+        # Return a list of the names of glyphs that use glyphn as a component
+        # The index is kept up to date by changes made via addGlyph(), delGlyph(), glyph renames and Uoutline object methods,
+        # but not by editing component elements directly
+        if self._compIndex is None :
+            self._compIndex = {}
+            for glyph in self._contents.values() : self._indexComponents(glyph, 1)
+        return self._compIndex.get(glyphn, {}).keys()
+
+    def usvGlyphs(self,usv) :
+        # Return a list of the names of glyphs encoded with usv (an integer codepoint)
+        # As with componentUsers(), the index is not updated if unicode elements are edited directly
+        return list(self._usvIndex.get(usv, []))
+
+    def duplicateUSVs(self) :
+        # Return {codepoint: [glyph names]} for codepoints that are used more than once
+        return dict((usv, list(names)) for usv, names in self._usvIndex.iteritems() if len(names) > 1)
+
+    def _indexUnicodes(self, glyph, incr, hexes = None) :
+        # Add glyph to (incr = 1) or remove it from (incr = -1) the codepoint index for its unicode values, or just hexes if supplied
+        if self._contents.get(glyph.name) is not glyph : return
+        if hexes is None : hexes = [uni.element.get('hex') for uni in glyph['unicode']]
+        for hexval in hexes :
+            try :
+                usv = int(hexval, 16)
+            except (TypeError, ValueError) :
+                continue # Invalid values are not indexed
+            if incr > 0 :
+                self._usvIndex.setdefault(usv, []).append(glyph.name)
+            else :
+                names = self._usvIndex.get(usv, [])
+                if glyph.name in names : names.remove(glyph.name)
+                if not names : self._usvIndex.pop(usv, None)
+
+    def _indexComponents(self, glyph, incr, bases = None) :
+        # Adjust the counts in the component index for glyph's components (or just bases, if supplied) by incr
+        if self._compIndex is None or self._contents.get(glyph.name) is not glyph : return
+        if bases is None :
+            outline = glyph['outline']
+            bases = [comp.element.get('base') for comp in outline.components] if outline is not None else []
+        for base in bases :
+            users = self._compIndex.setdefault(base, {})
+            count = users.get(glyph.name, 0) + incr
+            if count > 0 :
+                users[glyph.name] = count
+            else :
+                users.pop(glyph.name, None)
+                if not users : del self._compIndex[base]
+
+class Ukerning(object) :
+    # Index of a font's kerning and groups, working directly on the python values of the native kerning and groups
+    # plists (see Uplist), so fonts with 100k+ pairs can be processed without building etrees.
+    # kerning is {first: {second: value}} and groups is {group name: [glyph names]}, where first and second can be
+    # glyph or group names.  The reverse indexes are built when first needed and kept up to date by setPair(),
+    # removePair() and prune(), but not if kerning or groups are edited directly - use reset() after doing that.
+    # Kerning groups for each side are the public.kern1./public.kern2. groups for UFO 3, or, for UFO 2, the groups
+    # used on that side of a pair.
+
+    def __init__(self, font) :
+        self.font = font
+        self.kerning = font.kerning._contents if "kerning" in font.__dict__ else collections.OrderedDict()
+        self.groups = font.groups._contents if "groups" in font.__dict__ else collections.OrderedDict()
+        self.reset()
+
+    def reset(self) :
+        self._memberIndex = None # {glyph name: [group names]}
+        self._secondIndex = None # {second: set of firsts}
+        self._sideIndex = None # ({glyph name: first side group}, {glyph name: second side group})
+
+    def value(self, first, second) : # Value for the pair exactly as in kerning.plist, or None
+        return self.kerning.get(first, {}).get(second)
+
+    def setPair(self, first, second, value) :
+        if "kerning" not in self.font.__dict__ : self._makePlist("kerning", self.kerning)
+        if self.isGroup(first) or self.isGroup(second) : self._sideIndex = None # Group usage may change for UFO 2
+        self.kerning.setdefault(first, collections.OrderedDict())[second] = value
+        if self._secondIndex is not None : self._secondIndex.setdefault(second, set()).add(first)
+
+    def removePair(self, first, second) :
+        del self.kerning[first][second]
+        if not self.kerning[first] : del self.kerning[first]
+        if self._secondIndex is not None :
+            firsts = self._secondIndex[second]
+            firsts.discard(first)
+            if not firsts : del self._secondIndex[second]
+        if self.isGroup(first) or self.isGroup(second) : self._sideIndex = None
+
+    def isGroup(self, name) :
+        return name in self.groups
+
+    def pairsWith(self, name) : # List of (first, second) pairs that name (glyph or group) is part of
+        pairs = [(name, second) for second in self.kerning.get(name, {})]
+        pairs += [(first, name) for first in self._seconds().get(name, ()) if first != name]
+        return pairs
+
+    def glyphGroups(self, glyphn) : # List of all groups glyphn is a member of, kerning or otherwise
+        if self._memberIndex is None :
+            self._memberIndex = {}
+            for group in sorted(self.groups) :
+                for glyph in self.groups[group] : self._memberIndex.setdefault(glyph, []).append(group)
+        return list(self._memberIndex.get(glyphn, []))
+
+    def kernGroups(self, glyphn) : # (first side group, second side group) for glyphn, with None if there is not one
+        sides = self._sides()
+        return (sides[0].get(glyphn), sides[1].get(glyphn))
+
+    def groupSides(self) : # {group name: [sides (0 for first, 1 for second)]} for the kerning groups
+        used = (self.kerning, self._seconds())
+        ufo3 = self._ufo3groups()
+        kerngroups = {}
+        for group in self.groups :
+            if ufo3 :
+                sides = [side for side in (0, 1) if group.startswith(_kernPrefixes[side])]
+            else :
+                sides = [side for side in (0, 1) if group in used[side]]
+            if sides : kerngroups[group] = sides
+        return kerngroups
+
+    def pairValue(self, left, right) :
+        # Kerning value between two glyphs, allowing for groups with UFO 3 precedence of glyph-glyph, glyph-group,
+        # group-glyph then group-group pairs.  Returns None if the glyphs are not kerned
+        (lgroup, x) = self.kernGroups(left)
+        (x, rgroup) = self.kernGroups(right)
+        for (first, second) in ((left, right), (left, rgroup), (lgroup, right), (lgroup, rgroup)) :
+            if first is None or second is None : continue
+            value = self.value(first, second)
+            if value is not None : return value
+        return None
+
+    def flatten(self) :
+        # Return {(left glyph, right glyph): value} with all group pairs expanded to glyph pairs.
+        # Pairs are applied from least to most specific so precedence is as for pairValue()
+        flat = {}
+        for glyphfirst, glyphsecond in ((False, False), (False, True), (True, False), (True, True)) :
+            for first, seconds in self.kerning.iteritems() :
+                if self.isGroup(first) == glyphfirst : continue
+                lefts = [first] if glyphfirst else self.groups[first]
+                for second, value in seconds.iteritems() :
+                    if self.isGroup(second) == glyphsecond : continue
+                    rights = [second] if glyphsecond else self.groups[second]
+                    for left in lefts :
+                        for right in rights : flat[(left, right)] = value
+        return flat
+
+    def prune(self, glyphnames = None) :
+        # Remove group members that are not in glyphnames (defaults to the glyphs in the default layer), then remove
+        # pairs with a glyph not in glyphnames or a group that does not exist or is now empty.
+        # Returns ({group: [members removed]}, [(first, second) pairs removed])
+        if glyphnames is None : glyphnames = self.font.deflayer
+        members = {}
+        for group, glyphs in self.groups.iteritems() :
+            missing = [glyph for glyph in glyphs if glyph not in glyphnames]
+            if missing :
+                members[group] = missing
+                glyphs[:] = [glyph for glyph in glyphs if glyph in glyphnames]
+        def valid(name) :
+            return bool(self.groups[name]) if name in self.groups else name in glyphnames
+        pairs = []
+        for first in self.kerning.keys() :
+            seconds = self.kerning[first]
+            if not valid(first) :
+                pairs += [(first, second) for second in seconds]
+                del self.kerning[first]
+                continue
+            for second in [second for second in seconds if not valid(second)] :
+                pairs.append((first, second))
+                del seconds[second]
+            if not seconds : del self.kerning[first]
+        self.reset()
+        return (members, pairs)
+
+    def renameGlyphs(self, mapping) :
+        # Rename glyphs from {old name: new name} in groups and in the glyph names in kerning pairs
+        for glyphs in self.groups.itervalues() : glyphs[:] = [mapping.get(glyph, glyph) for glyph in glyphs]
+        kerning = collections.OrderedDict()
+        for first, seconds in self.kerning.iteritems() :
+            if not self.isGroup(first) : first = mapping.get(first, first)
+            kerning[first] = collections.OrderedDict((second if self.isGroup(second) else mapping.get(second, second), value)
+                for second, value in seconds.iteritems())
+        self.kerning.clear()
+        self.kerning.update(kerning)
+        self.reset()
+
+    def compacted(self) :
+        # Return (groups, kerning) for kerning groups and pairs that give the same flattened kerning as now with fewer
+        # pairs plus group members, or the current kerning groups and kerning if that would not be smaller.
+        # Existing kerning groups are kept, and glyphs not in one are grouped with glyphs with identical kerning, found
+        # by hashing the glyph's row or column of flattened kerning.  New groups are named by prefixing their first glyph.
+        # For each pair of classes (a group or single glyph on each side) the commonest value is used for the class
+        # pair, then glyph-class and class-glyph pairs where they save pairs, with glyph pairs only for the exceptions.
+        flat = dict((pair, value) for pair, value in self.flatten().iteritems() if value) # No kerning is the same as 0
+        vectors = ({}, {})
+        for (left, right), value in flat.iteritems() :
+            vectors[0].setdefault(left, []).append((right, value))
+            vectors[1].setdefault(right, []).append((left, value))
+
+        oldgroups = self.groupSides()
+        ufo3 = self._ufo3groups() or (not oldgroups and self.font.outparams["UFOversion"] == "3")
+        prefixes = _kernPrefixes if ufo3 else _kernPrefixesUFO2
+        sides = self._sides()
+        groups = collections.OrderedDict((group, list(self.groups[group])) for group in oldgroups)
+        classes = (dict(sides[0]), dict(sides[1]))
+        for side in (0, 1) :
+            samekern = {}
+            for glyph, vector in vectors[side].iteritems() :
+                if glyph not in classes[side] : samekern.setdefault(frozenset(vector), []).append(glyph)
+            for glyphs in sorted(sorted(glyphs) for glyphs in samekern.values()) :
+                name = glyphs[0]
+                if len(glyphs) > 1 :
+                    name = prefixes[side] + glyphs[0]
+                    while name in self.groups or name in groups : name += "_"
+                    groups[name] = glyphs
+                for glyph in glyphs : classes[side][glyph] = name
+
+        blocks = {}
+        for (left, right), value in flat.iteritems() :
+            blocks.setdefault((classes[0][left], classes[1][right]), {})[(left, right)] = value
+        kerning = collections.OrderedDict()
+        def setpair(first, second, value) : kerning.setdefault(first, collections.OrderedDict())[second] = value
+        for (lname, rname) in sorted(blocks) :
+            cells = blocks[(lname, rname)]
+            lglyphs = groups[lname] if lname in groups else [lname]
+            rglyphs = groups[rname] if rname in groups else [rname]
+            rows = [(left, [cells.get((left, right), 0) for right in rglyphs]) for left in lglyphs]
+            base = _commonest(value for left, row in rows for value in row)
+            if base : setpair(lname, rname, base)
+            if len(lglyphs) > 1 and len(rglyphs) > 1 :
+                others = []
+                for left, row in rows : # glyph-class pairs, which take precedence over class-glyph pairs
+                    rowbase = _commonest(row)
+                    if 1 + _differ(row, rowbase) < _differ(row, base) :
+                        setpair(left, rname, rowbase)
+                        for right, value in zip(rglyphs, row) :
+                            if value != rowbase : setpair(left, right, value)
+                    else :
+                        others.append((left, row))
+                for i, right in enumerate(rglyphs) : # class-glyph pairs for glyphs without a glyph-class pair
+                    col = [row[i] for left, row in others]
+                    colbase = _commonest(col) if col else base
+                    if 1 + _differ(col, colbase) < _differ(col, base) :
+                        setpair(lname, right, colbase)
+                    else :
+                        colbase = base
+                    for (left, row), value in zip(others, col) :
+                        if value != colbase : setpair(left, right, value)
+            else :
+                for left, row in rows :
+                    for right, value in zip(rglyphs, row) :
+                        if value != base : setpair(left, right, value)
+
+        size = lambda groups, kerning : sum(len(seconds) for seconds in kerning.itervalues()) + sum(len(glyphs) for glyphs in groups.itervalues())
+        oldkerning = collections.OrderedDict((first, collections.OrderedDict(seconds)) for first, seconds in self.kerning.iteritems())
+        oldgroups = collections.OrderedDict((group, list(self.groups[group])) for group in oldgroups)
+        if size(groups, kerning) >= size(oldgroups, oldkerning) : return (oldgroups, oldkerning)
+        return (groups, kerning)
+
+    def setKerning(self, groups, kerning) :
+        # Replace the kerning groups and kerning, eg with the values from compacted(); other groups are kept
+        for group in self.groupSides() :
+            if group not in groups : del self.groups[group]
+        self.groups.update(groups) # Groups that are kept stay in the same place
+        self.kerning.clear()
+        self.kerning.update(kerning)
+        if "groups" not in self.font.__dict__ and self.groups : self._makePlist("groups", self.groups)
+        if "kerning" not in self.font.__dict__ and self.kerning : self._makePlist("kerning", self.kerning)
+        self.reset()
+
+    def _seconds(self) :
+        if self._secondIndex is None :
+            self._secondIndex = {}
+            for first, seconds in self.kerning.iteritems() :
+                for second in seconds : self._secondIndex.setdefault(second, set()).add(first)
+        return self._secondIndex
+
+    def _sides(self) :
+        if self._sideIndex is None :
+            self._sideIndex = ({}, {})
+            for group, sides in sorted(self.groupSides().iteritems(), reverse = True) : # So the first group is used for UFO 2
+                for side in sides :
+                    for glyph in self.groups[group] : self._sideIndex[side][glyph] = group
+        return self._sideIndex
+
+    def _ufo3groups(self) :
+        return any(group.startswith(_kernPrefixes) for group in self.groups)
+
+    def _makePlist(self, name, contents) :
+        plist = Uplist(font = self.font, native = True)
+        plist._rootattrib = {"version": "1.0"}
+        plist._contents = contents
+        setattr(self.font, name, plist)
+
 class Uplist(xmlitem, _plist) :
+    # If native is True, the plist is converted to python values (see plistValue) and the etree discarded, so items
+    # are python values rather than [keyelem, valelem] pairs.  The etree is only rebuilt, by syncET(), for output.
+    # Converting takes about twice as long as just parsing (1.0s against 0.5s for 200,000 kerning pairs), but then
+    # the values can be used directly, eg by Ukerning, rather than reading them from elements each time.
+    # Dicts are read as OrderedDicts, so keys are output in the same order unless sortDicts is set
 
-    def __init__(self, font = None, dirn = None, filen = None, parse = True) :
+    def __init__(self, font = None, dirn = None, filen = None, parse = True, native = False) :
         if dirn is None and font: dirn = font.ufodir
         xmlitem.__init__(self, dirn, filen, parse)
         self.type = "plist"
         self.font = font
         self.outparams = None
-        if filen and dirn : self.populate_dict()
+        self._removed = []
+        self.native = native
+        if native :
+            self._rootattrib = {}
+            if self.etree is not None :
+                self._rootattrib = dict(self.etree.attrib)
+                self._contents = plistValue(self.etree[0], True)
+                self.etree = None
+        elif filen and dirn : self.populate_dict()
 
     def populate_dict(self) :
+        self.syncET()
         self._contents.clear() # Clear existing contents, if any
         pl = self.etree[0]
         if pl.tag == "dict" :
@@ -427,6 +920,76 @@ class Uplist(xmlitem, _plist) :
             for i in range(len(pl)) :
                 self._contents[i] = pl[i]
 
+def _commonest(values) : # Commonest kerning value, preferring 0 (no pair) then the lowest value on ties
+    counts = {}
+    for value in values : counts[value] = counts.get(value, 0) + 1
+    return min(counts, key = lambda value : (-counts[value], value != 0, value))
+
+def _differ(values, base) :
+    return sum(1 for value in values if value != base)
+
+def _plistValue(tag, text) :
+    # Convert the text of a simple plist element to a python value
+    if tag == "string" : return text
+    if tag == "integer" : return int(text)
+    if tag == "real" : return float(text)
+    if tag == "true" : return True
+    if tag == "false" : return False
+    if tag == "date" : return datetime.datetime.strptime(text.strip(), "%Y-%m-%dT%H:%M:%SZ")
+    if tag == "data" : return plistlib.Data(base64.b64decode("".join(text.split())))
+    raise ValueError("Invalid plist element: " + tag)
+
+def plistValue(element, consume = False) :
+    # Convert a plist value element to python values: OrderedDict, list, string, int, float, bool, datetime or plistlib.Data
+    # With consume, a dict element's items are removed as they are converted, so memory used by the etree is freed as
+    # the values are built
+    tag = element.tag
+    if tag == "dict" :
+        if consume : # Items are taken from the end, since removing them from the start would be quadratic
+            items = []
+            while len(element) :
+                items.append((element[-2].text or "", plistValue(element[-1])))
+                del element[-2:]
+            items.reverse()
+            return collections.OrderedDict(items)
+        items = list(element)
+        return collections.OrderedDict([(items[i].text or "", plistValue(items[i+1])) for i in xrange(0, len(items), 2)])
+    if tag == "array" : return [plistValue(subelem) for subelem in element]
+    if tag == "string" : return element.text or ""
+    if tag == "integer" : return int(element.text)
+    return _plistValue(tag, element.text or "")
+
+def plistElement(value) :
+    # Convert a python value (as returned by plistValue) to a plist value element
+    # Keys are output in order for OrderedDicts, or sorted for other dicts, which have no order; see also sortDicts
+    if isinstance(value, dict) :
+        element = ET.Element("dict")
+        for key in (value if isinstance(value, collections.OrderedDict) else sorted(value)) :
+            ET.SubElement(element, "key").text = key
+            element.append(plistElement(value[key]))
+        return element
+    if isinstance(value, (list, tuple)) :
+        element = ET.Element("array")
+        for subval in value : element.append(plistElement(subval))
+        return element
+    if isinstance(value, bool) : return ET.Element("true" if value else "false")
+    if isinstance(value, (int, long)) :
+        element = ET.Element("integer")
+        element.text = str(value)
+    elif isinstance(value, float) :
+        element = ET.Element("real")
+        element.text = repr(value)
+    elif isinstance(value, datetime.datetime) :
+        element = ET.Element("date")
+        element.text = value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    elif isinstance(value, plistlib.Data) :
+        element = ET.Element("data")
+        element.text = base64.b64encode(value.data)
+    else :
+        element = ET.Element("string")
+        element.text = value
+    return element
+
 class Uglif(xmlitem) :
     # Unlike plists, glifs can have multiples of some sub-elements (eg anchors) so create lists for those
 
@@ -439,6 +1002,9 @@ class Uglif(xmlitem) :
         self.name = name
         self.outparams = None
         self.glifElemOrder = self.layer.font.outparams["glifElemOrder"]
+        self._anchorMap = None # Caches for anchorMap(), getAnchor() and advanceWidth()
+        self._anchorIndex = None
+        self._advanceWidth = None
         # Set initial values for sub-objects
         for elem in self.glifElemOrder :
             if elem in _glifElemMulti :
@@ -448,9 +1014,13 @@ class Uglif(xmlitem) :
         if self.etree is not None : self.process_etree()
 
     def __setattr__(self, name, value) :
+        renamed = False
         if name == "name" and getattr(self,"name",None): # Existing glyph name is being changed
             oname = self.name
             if value in self.layer._contents : self.layer.font.logger.log(name + " already in font", "X")
+            self.layer._indexComponents(self, -1) # Remove from indexes under the old name
+            self.layer._indexUnicodes(self, -1)
+            renamed = True
             # Update the _contents disctionary
             del self.layer._contents[oname]
             self.layer._contents[value] = self
@@ -469,6 +1039,9 @@ class Uglif(xmlitem) :
             self.filen = glifn
             self.layer.dtree[glifn] = dirTreeItem(read = False, added = True, fileObject = self, fileType = "xml")
         super(Uglif,self).__setattr__(name,value)
+        if renamed :
+            self.layer._indexComponents(self, 1)
+            self.layer._indexUnicodes(self, 1)
 
     def process_etree(self) :
         et = self.etree
@@ -523,21 +1096,27 @@ class Uglif(xmlitem) :
         multi = True if ename in _glifElemMulti else False
 
         # Check element does not already exist for single elements
-        if self._contents[ename] and not multi : self.layer.font.logger.log( "Already an " + enam + "in glif", "X")
+        if self._contents[ename] and not multi : self.layer.font.logger.log( "Already an " + ename + " in glif", "X")
 
         # Add new object
         if multi :
             self._contents[ename].append(self.makeObject(ename,element))
         else:
             self._contents[ename] = self.makeObject(ename,element)
+        self.clearCache(ename)
+        if ename == "unicode" : self.layer._indexUnicodes(self, 1, [element.get('hex')])
+        if ename == "outline" : self.layer._indexComponents(self, 1)
 
     def remove(self, ename, index = None, object = None ) :
         # Remove object from a glif
         # For multi objects, an index or object must be supplied to identify which
         # to delete
+        self.clearCache(ename)
+        if ename == "outline" and self._contents[ename] is not None : self.layer._indexComponents(self, -1)
         if ename in _glifElemMulti :
             item = self._contents[ename]
             if index is None : index = item.index(object)
+            if ename == "unicode" : self.layer._indexUnicodes(self, -1, [item[index].element.get('hex')])
             del item[index]
         else :
             self._contents[ename] = None
@@ -556,6 +1135,55 @@ class Uglif(xmlitem) :
             self._contents['outline'].appendobject(Ucontour(self._contents['outline'],contelement),"contour")
             self.remove('anchor',object=anchor)
 
+    def anchorMap(self) :
+        # Return an ordered dict of {anchor name: (x,y)} with numeric x and y values
+        # The map is cached until anchors are added or removed with add() and remove();
+        # if anchor elements are edited directly, call clearCache() afterwards
+        if self._anchorMap is None :
+            amap = collections.OrderedDict()
+            for anchor in self._contents['anchor'] :
+                attrib = anchor.element.attrib
+                amap[attrib.get('name')] = (_numval(attrib.get('x', 0)), _numval(attrib.get('y', 0)))
+            self._anchorMap = amap
+        return self._anchorMap
+
+    def getAnchor(self, name) :
+        # Return the Uanchor object for the anchor called name, or None.  Uses a name index cached in the same way as anchorMap()
+        if self._anchorIndex is None :
+            self._anchorIndex = {}
+            for anchor in self._contents['anchor'] : self._anchorIndex.setdefault(anchor.element.get('name'), anchor)
+        return self._anchorIndex.get(name)
+
+    def setAnchors(self, anchors, replace = False) :
+        # Set anchors from a list of (name, x, y) tuples, with x and y as strings
+        # Existing anchors with the same names are removed and the new anchors are added after the remaining ones,
+        # or, if replace is True, all existing anchors are removed first
+        # If a name is repeated in anchors the last one is used, as if the anchors had been set one at a time
+        latest = collections.OrderedDict()
+        for (name, x, y) in anchors :
+            latest.pop(name, None)
+            latest[name] = (x, y)
+        if replace :
+            kept = []
+        else :
+            kept = [anchor for anchor in self._contents['anchor'] if anchor.element.get('name') not in latest]
+        for name, (x, y) in latest.iteritems() :
+            kept.append(self.makeObject('anchor', ET.Element('anchor', {'name': name, 'x': x, 'y': y})))
+        self._contents['anchor'] = kept
+        self.clearCache('anchor')
+
+    def advanceWidth(self) :
+        # Return the numeric advance width (0 if not set), cached in the same way as anchorMap()
+        if self._advanceWidth is None :
+            advance = self._contents['advance']
+            self._advanceWidth = _numval(advance.element.get('width', 0)) if advance is not None else 0
+        return self._advanceWidth
+
+    def clearCache(self, ename = None) :
+        # Clear the cached values for element ename, or all cached values if ename is None
+        if ename in (None, 'anchor') : self._anchorMap = self._anchorIndex = None
+        if ename in (None, 'advance') : self._advanceWidth = None
+
     def makeObject(self, type, element) :
         if type == 'advance'   : return Uadvance(self,element)
         if type == 'unicode'   : return Uunicode(self,element)
@@ -613,17 +1241,23 @@ class Uoutline(Uelement) :
 
     def removeobject(self,object,type) :
         super(Uoutline,self).remove(object.element)
-        if type == "component" : self.components.remove(object)
+        if type == "component" :
+            self.components.remove(object)
+            self.glif.layer._indexComponents(self.glif, -1, [object.element.get('base')])
         if type == "contour" : self.contours.remove(object)
 
     def appendobject(self,object,type) :
         super(Uoutline,self).append(object.element)
-        if type == "component" : self.components.append(object)
+        if type == "component" :
+            self.components.append(object)
+            self.glif.layer._indexComponents(self.glif, 1, [object.element.get('base')])
         if type == "contour" : self.contours.append(object)
 
     def insertobject(self,index,object,type) :
         super(Uoutline,self).insert(index,object.element)
-        if type == "component" : self.components.insert(index,object)
+        if type == "component" :
+            self.components.insert(index,object)
+            self.glif.layer._indexComponents(self.glif, 1, [object.element.get('base')])
         if type == "contour" : self.contours.insert(index,object)
 
 class Ucomponent(Uelement) :
@@ -649,9 +1283,11 @@ class Ulib(_Ucontainer, _plist) :
         self.element = element # needs both element and etree fo compatibility
         self.etree = element   # with other glif components and _plist methods
         self._contents = {}
+        self._removed = []
         self.reindex()
 
     def reindex(self) :
+        self.syncET()
         self._contents.clear() # Clear existing contents, if any
         pl = self.element[0]
         if pl.tag == "dict" :
@@ -664,6 +1300,25 @@ class UfeatureFile(UtextFile) :
     def __init__(self, font, dirn, filen) :
         super(UfeatureFile,self).__init__(font,dirn,filen)
 
+    def renameGlyphs(self, mapping) :
+        # Rename glyph names from {old name: new name} in a single pass through the text.  Names following keywords
+        # such as lookup or feature and after a closing brace are labels or tags, so are not renamed
+        counts = [0]
+        prev = [None]
+        def rename(match) :
+            (skip, brace, escape, name) = match.groups()
+            if name is None :
+                if brace : prev[0] = brace
+                return match.group(0)
+            label = prev[0] == "}" or prev[0] in _feaLabelKeywords
+            prev[0] = name
+            if label or name not in mapping : return match.group(0)
+            counts[0] += 1
+            return escape + mapping[name]
+        text = _feaTokens.sub(rename, self.gettext())
+        if counts[0] : self.settext(text)
+        return counts[0]
+
 def writeXMLobject(dtreeitem, font, dirn, filen, exists) :
     params = font.outparams
 
@@ -672,7 +1327,9 @@ def writeXMLobject(dtreeitem, font, dirn, filen, exists) :
     indentFirst = params["indentFirst"]
     attribOrder = {}
     if object.type in params['attribOrders'] : attribOrder = params['attribOrders'][object.type]
+    if object.type == "glif" and object["lib"] is not None : object["lib"].syncET()
     if object.type == "plist" :
+        object.syncET()
         indentFirst = params["plistIndentFirst"]
         object.etree.attrib[".doctype"] = 'plist PUBLIC "-//Apple Computer//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd"'
 
@@ -855,6 +1512,13 @@ def normETdata(element, params, type) :
                 element[i+1] = edict[key][1]
                 i=i+2
 
+def _numval(value) :
+    # Convert a numeric attribute value to an int, or a float if it is not a whole number
+    try :
+        return int(value)
+    except ValueError :
+        return float(value)
+
 def getattrib(element,attrib) :
     if attrib in element.attrib :
         return element.attrib[attrib]
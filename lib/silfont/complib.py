@@ -91,6 +91,112 @@ paramdef=re.compile(r"""^\s*
     (?:;\s*(?P<rest>.+)$|\s*$)              # either ; and (non-empty) rest of parameters, or end of line
     """,re.VERBOSE)
 
+# Characters and names used by the single-pass scanner (_scanCDline) below
+_markchars = " .0123456789"
+_metricchars = "-0123456789"
+_namere = re.compile(r"[._A-Za-z][._A-Za-z0-9]*\Z")
+_paramnamere = re.compile(r"[a-z0-9]+\Z")
+
+# One base or diacritic: name, optional @base:position, optional [params], then + or & or end of line.
+# Deliberately stricter than compdef: anything it does not accept is left to the regexes above
+comptoken=re.compile(r"""
+    (?P<compname>[._A-Za-z][._A-Za-z0-9]*)
+    (?:@(?:(?P<base>[^: ]+):|(?![^: ]+:))(?P<position>[^: +&[\]]+))?
+    \ *(?:\[(?P<params>[^][]*)\])?\ *
+    (?:(?P<sep>[+&])\ *|\Z)
+    """,re.VERBOSE)
+
+def _scanCDline(line):
+    """Split a CD line in one pass using string methods, giving the same results as the regexes
+    in initialtokens. Returns False for a blank or comment-only line, None if the line uses any
+    construct the scanner does not handle (including all errors), otherwise a tuple of
+    (attributes, note, glyph parameters, markinfo, metrics, list of components)
+    """
+    if line.endswith('\n'): line = line[:-1]
+    if '\n' in line or '\r' in line or '\f' in line or '\v' in line: return None
+    line, hashchar, note = line.partition('#')
+    note = note.strip() if hashchar else None
+    line = line.strip()
+    if not line: return False
+
+    # Parameters in [...] after |, removed with the same rstrip as the regex version
+    paramdata = None
+    bar = line.find('|')
+    if bar >= 0:
+        a = line.find('[', bar)
+        if a >= 0:
+            if line.find(']', a) != len(line) - 1: return None
+            paramdata = line[a+1:-1]
+            line = line.rstrip('[' + paramdata + ']')
+            paramdata = paramdata.strip()
+    # ! markinfo, which must be 4 comma-separated numbers
+    mark = None
+    if '!' in line:
+        line, sep, mark = line.partition('!')
+        mark = mark.strip()
+        parts = mark.split(',')
+        if '!' in mark or len(parts) != 4 or not parts[0] or parts[0].strip(_markchars[1:]): return None
+        for part in parts[1:]:
+            if not part or part.strip(_markchars): return None
+    # | UID
+    results = {}
+    if '|' in line:
+        line, sep, uid = line.partition('|')
+        if '|' in uid or '^' in uid: return None
+        uid = uid.strip()
+        if uid: results['UID'] = uid
+    elif paramdata is not None:
+        return None
+    # ^ metrics, either advance or lsb,rsb
+    metrics = None
+    if '^' in line:
+        line, sep, metrics = line.partition('^')
+        metrics = metrics.strip()
+        parts = metrics.split(',')
+        if '^' in metrics or len(parts) > 2: return None
+        for part in parts:
+            part = part.strip()
+            if not part or part.strip(_metricchars): return None
+    # glyph name =
+    name, sep, line = line.partition('=')
+    name = name.strip()
+    if not sep or not _namere.match(name): return None
+    results['PSName'] = name
+
+    line = line.strip()
+    if '\t' in line: return None
+    comps = []
+    pos = 0
+    expectingdiac = False
+    while pos < len(line):
+        m = comptoken.match(line, pos)
+        if m is None: return None
+        comps.append((m.group('compname'), m.group('base'), m.group('position'), m.group('params'), expectingdiac))
+        expectingdiac = m.group('sep') == '+'
+        pos = m.end()
+        if m.group('sep') and pos == len(line): return None
+    return (results, note, paramdata, mark, metrics, comps)
+
+def _compsfromline(remainder):
+    """Generate (name, base, position, params, expectingdiac) for each base or diacritic in the
+    remainder of a CD line using the compdef regex. Errors are raised as each one is reached"""
+    expectingdiac = False
+    while remainder != "":
+        matchresults=re.match(compdef,remainder)
+        if matchresults == None or matchresults.group('compname') == "" :
+            raise ValueError("Error parsing glyph name: " + remainder)
+        yield (matchresults.group('compname'), matchresults.group('base'), matchresults.group('position'),
+               matchresults.group('params'), expectingdiac)
+        remainder = matchresults.group('remainder').lstrip()
+        nextchar = remainder[:1]
+        remainder = remainder[1:].lstrip()
+        expectingdiac = nextchar == '+'
+        if nextchar == '&' or nextchar == '+':
+            if len(remainder) == 0:
+                raise ValueError("Expecting glyph name after & or +")
+        elif len(nextchar) > 0:
+            raise ValueError("Expecting & or + and found " + nextchar)
+
 class CompGlyph(object):
 
     def __init__(self, CDelement=None, CDline=None):
@@ -102,6 +208,17 @@ class CompGlyph(object):
         key1=value1;key2=value2
         and return a dictionary with key:value pairs.
         """
+        params = {}
+        for item in rest.split(';'):
+            name, sep, value = item.partition('=')
+            name = name.strip()
+            value = value.strip()
+            if not (sep and value and _paramnamere.match(name)):
+                return self._parseparamsRE(rest) # gives the error message, or handles any unusual spacing
+            params[name] = value
+        return(params)
+
+    def _parseparamsRE(self, rest):
         params = {}
         while rest:
             matchparam=re.match(paramdef,rest)
@@ -123,7 +240,17 @@ class CompGlyph(object):
           </base>
         </glyph>
         Position info after @ can include optional base glyph name followed by colon.
+        Lines are split by _scanCDline where possible, otherwise by the regexes in initialtokens.
         """
+        tokens = _scanCDline(self.CDline)
+        if tokens is None:
+            tokens = self._splitCDlineRE()
+        if tokens:
+            self._makeCDelement(*tokens)
+
+    def _splitCDlineRE(self):
+        """Split self.CDline using the regexes in initialtokens, returning the same as _scanCDline
+        except that the components are generated by _compsfromline"""
         line = self.CDline
         results = {}
         for parseinfo in initialtokens:
@@ -146,23 +273,29 @@ class CompGlyph(object):
             if len(results) > 0:
                 raise ValueError("Missing glyph name")
             else: # comment only, or blank line
-                return None
-        dic = {}
+                return False
+        paramdata = None
         UIDpresent = 'UID' in results
         if UIDpresent and results['UID'] == '':
             results.pop('UID')
         if 'paraminfo' in results:
             paramdata = results.pop('paraminfo')
-            if UIDpresent:
-                dic = self._parseparams(paramdata)
-            else:
+            if not UIDpresent:
                 line += " [" + paramdata + "]"
+                paramdata = None
         mark = results.pop('markinfo', None)
-        if 'metrics' in results:
-            m = results.pop('metrics')
-            matchmetrics = re.match(lsb_rsb,m)
+        metrics = results.pop('metrics', None)
+        return (results, note, paramdata, mark, metrics, _compsfromline(line))
+
+    def _makeCDelement(self, results, note, paramdata, mark, metrics, comps):
+        """Build the <glyph> element (in self.CDelement) from the parts of a CD line"""
+        dic = {}
+        if paramdata is not None:
+            dic = self._parseparams(paramdata)
+        if metrics is not None:
+            matchmetrics = re.match(lsb_rsb,metrics)
             if matchmetrics == None:
-                raise ValueError("Error in parameters: " + m)
+                raise ValueError("Error in parameters: " + metrics)
             elif matchmetrics.group('rsb'):
                 metricdic = {'lsb': matchmetrics.group('lsb'), 'rsb': matchmetrics.group('rsb')}
             else:
@@ -187,25 +320,16 @@ class CompGlyph(object):
             for key in metricdic:
                 k = ET.SubElement(g, key, width=metricdic[key])
 
-        # Prepare to parse remainder of line
+        # Process the bases and diacritics from left to right
         prevbase = None
         prevdiac = None
-        remainder = line
-        expectingdiac = False
-
-        # top of loop to process remainder of line, breaking off base or diacritics from left to right
-        while remainder != "":
-            matchresults=re.match(compdef,remainder)
-            if matchresults == None or matchresults.group('compname') == "" :
-                raise ValueError("Error parsing glyph name: " + remainder)
+        for compname, base, position, params, expectingdiac in comps:
             propdic = {}
-            if matchresults.group('params'):
-                propdic = self._parseparams(matchresults.group('params'))
-            base = matchresults.group('base')
-            position = matchresults.group('position')
+            if params:
+                propdic = self._parseparams(params)
             if expectingdiac:
                 # Determine parent element, based on previous base and diacritic glyphs and optional
-                # matchresults.group('base'), indicating diacritic attaches to a different glyph
+                # base, indicating diacritic attaches to a different glyph
                 if base == None:
                     if prevdiac != None:
                         parent = prevdiac
@@ -219,7 +343,7 @@ class CompGlyph(object):
                         raise ValueError("Unnecessary diacritic alternate base glyph: " + base)
                 # Because 'with' is Python reserved word, passing it directly as a parameter
                 # causes Python syntax error, so build dictionary to pass to SubElement
-                att = {'PSName': matchresults.group('compname')}
+                att = {'PSName': compname}
                 if position:
                     if 'with' in propdic:
                         withval = propdic.pop('with')
@@ -234,7 +358,7 @@ class CompGlyph(object):
                 raise ValueError("Position information on base glyph not supported")
             else:
                 # Create <base> subelement
-                e = ET.SubElement(g, 'base', PSName=matchresults.group('compname'))
+                e = ET.SubElement(g, 'base', PSName=compname)
                 prevbase = e
                 prevdiac = None
             if 'shift' in propdic:
@@ -243,16 +367,6 @@ class CompGlyph(object):
             # whatever parameters are left in propdic become <property> subelements
             for key, val in propdic.items():
                 p = ET.SubElement(e, 'property', name=key, value=val)
-
-            remainder = matchresults.group('remainder').lstrip()
-            nextchar = remainder[:1]
-            remainder = remainder[1:].lstrip()
-            expectingdiac = nextchar == '+'
-            if nextchar == '&' or nextchar == '+':
-                if len(remainder) == 0:
-                    raise ValueError("Expecting glyph name after & or +")
-            elif len(nextchar) > 0:
-                raise ValueError("Expecting & or + and found " + nextchar)
         self.CDelement = g
 
     def _diacinfo(self, node, parent, lastglyph):
@@ -267,7 +267,7 @@ class xmlitem(object) :
         self.dirn = dirn
         self.filen = filen
         self.inxmlstr = ""
-        self.outxmlstr = ""
+        self._outxml = [] # Parts of the output xml; see outxmlstr below
         self.etree = None
         self.type = None
         if filen and dirn :
@@ -276,14 +276,22 @@ class xmlitem(object) :
             except Exception as e :
                 print e
                 sys.exit(1)
-            for line in inxml.readlines() :
-                self.inxmlstr = self.inxmlstr + line
+            self.inxmlstr = inxml.read()
             inxml.close()
             if parse :
                 self.etree = ET.fromstring(self.inxmlstr)
 
     def write_to_xml(self,text) : # Used by ETWriter.serialize_xml()
-        self.outxmlstr = self.outxmlstr + text
+        self._outxml.append(text) # Adding to a string attribute copies the whole string each time
+
+    @property
+    def outxmlstr(self) :
+        if len(self._outxml) <> 1 : self._outxml = ["".join(self._outxml)]
+        return self._outxml[0]
+
+    @outxmlstr.setter
+    def outxmlstr(self, value) :
+        self._outxml = [value]
 
     def write_to_file(self,dirn,filen) :
         outfile=codecs.open(os.path.join(dirn,filen),'w','utf-8')
@@ -298,6 +306,8 @@ class xmlitem(object) :
         return self._contents[key]
     def __iter__(self):
         return iter(self._contents)
+    def __contains__(self, key):
+        return key in self._contents
     def keys(self) :
         return self._contents.keys()
 
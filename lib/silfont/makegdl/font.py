@@ -17,10 +17,13 @@
 #    suite 500, Boston, MA 02110-1335, USA or visit their web page on the 
 #    internet at http://www.fsf.org/licenses/lgpl.html.
 
-import os, re, traceback
+import os, re, traceback, hashlib
+from array import array
+import cPickle as pickle
 from silfont.makegdl.glyph import Glyph
 from silfont.makegdl.psnames import Name
-from xml.etree.cElementTree import ElementTree, parse, Element
+from silfont.makegdl.ot import LookupResults
+from xml.etree.cElementTree import iterparse, tostring, Element
 from fontTools.ttLib import TTFont
 
 # A collection of glyphs that have a given attachment point defined
@@ -30,12 +33,18 @@ class PointClass(object) :
         self.name = name
         self.glyphs = []
         self.dias = []
+        self.glyphSet = set()   # set indexes of glyphs and dias for fast membership tests
+        self.diaSet = set()
+        self.notDias = []       # complement classes, see Font.calculateComplementClasses
+        self.notGlyphs = []
 
     def addBaseGlyph(self, g) :
         self.glyphs.append(g)
+        self.glyphSet.add(g)
 
     def addDiaGlyph(self, g) :
         self.dias.append(g)
+        self.diaSet.add(g)
         g.isDia = True
 
     def hasDias(self) :
@@ -50,17 +59,25 @@ class PointClass(object) :
         else :
             return self.glyphs
 
+    def classNotGlyphs(self, isDia = False) :
+        if isDia :
+            return self.notDias
+        else :
+            return self.notGlyphs
+
     def isNotInClass(self, g, isDia = False) :
         if not g : return False
         if not g.isDia : return False
             
         if isDia :
-            return g not in self.dias
+            return g not in self.diaSet
         else :
-            return g not in self.dias and g not in self.glyphs
+            return g not in self.diaSet and g not in self.glyphSet
 
 
 class FontClass(object) :
+    """A glyph class held as an ordered array of gids, with -1 for a glyph that is
+    not in the font, plus a bitset over the gids for fast membership tests"""
 
     def __init__(self, elements = None, fname = None, lineno = None, generated = False, editable = False) :
         self.elements = elements or []
@@ -69,8 +86,59 @@ class FontClass(object) :
         self.generated = generated
         self.editable = editable
 
-    def append(self, element) :
-        self.elements.append(element)
+    def _getElements(self) : # A tuple, since changes must go through append() and extend() to update gids and bits
+        return tuple(x if x >= 0 else None for x in self.gids)
+
+    def _setElements(self, elements) :
+        self.gids = array('i')
+        self.bits = bytearray()
+        self.extend(elements)
+
+    elements = property(_getElements, _setElements)
+
+    def append(self, gid) :
+        if gid is None :
+            self.gids.append(-1)
+            return
+        self.gids.append(gid)
+        i = gid >> 3
+        if i >= len(self.bits) : self.bits.extend(bytearray(i - len(self.bits) + 1))
+        self.bits[i] |= 1 << (gid & 7)
+
+    def extend(self, gids) :
+        for gid in gids : self.append(gid)
+
+    def __contains__(self, gid) :
+        if gid is None or gid < 0 or (gid >> 3) >= len(self.bits) : return False
+        return bool(self.bits[gid >> 3] & (1 << (gid & 7)))
+
+    def __len__(self) :
+        return len(self.gids)
+
+    def glyphs(self, font) :
+        return [font[x] if x >= 0 else None for x in self.gids]
+
+
+class GDLWriter(object) :
+    """Collects the many small pieces of generated GDL and writes them to the
+    underlying file in large blocks"""
+
+    def __init__(self, fh, bufsize = 65536) :
+        self.fh = fh
+        self.bufsize = bufsize
+        self.buf = []
+        self.size = 0
+
+    def write(self, s) :
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size >= self.bufsize : self.flush()
+
+    def flush(self) :
+        if self.buf :
+            self.fh.write("".join(self.buf))
+            self.buf = []
+            self.size = 0
 
 
 class Font(object) :
@@ -89,7 +157,7 @@ class Font(object) :
         self.rules = {}
         self.posRules = {}
         if fontfile :
-            self.font = TTFont(fontfile)
+            self.font = TTFont(fontfile, lazy = True)   # only decompile the tables (and subtables) we use
             for i, n in enumerate(self.font.getGlyphOrder()) :
                 self.addGlyph(i, n)
         else :
@@ -130,16 +198,19 @@ class Font(object) :
         if index is not None and index < len(self.glyphs) and self.glyphs[index] :
             g = self.glyphs[index]
             return g
+        if index is None : index = len(self.glyphs)  # give it the next available index
         g = factory(psName, index) # create a new glyph of the given class
         self.renameGlyph(g, psName, gdlName)
-        if index is None :  # give it the next available index
-            index = len(self.glyphs) 
-            self.glyphs.append(g)
-        elif index >= len(self.glyphs) :
-            self.glyphs.extend([None] * (len(self.glyphs) - index + 1))
-        self.glyphs[index] = g
+        self.setGlyph(index, g)
         return g
 
+    # All changes to the glyph table go through here so that it only grows as far as needed
+    def setGlyph(self, index, g) :
+        if index >= len(self.glyphs) :
+            self.glyphs.extend([None] * (index - len(self.glyphs) + 1))
+        self.glyphs[index] = g
+        if g : g.gid = index
+
     def renameGlyph(self, g, name, gdlName = None) :
         if g.psname != name :
             for n in g.parseNames() :
@@ -171,14 +242,17 @@ class Font(object) :
         self.gdls[name] = glyph
         glyph.setGDL(name)
 
+    # Class members may be given as glyphs or gids, and are stored as gids
     def addClass(self, name, elements, fname = None, lineno = 0, generated = False, editable = False) :
         if name :
-            self.classes[name] = FontClass(elements, fname, lineno, generated, editable)
+            gids = [getattr(e, 'gid', e) for e in elements]
+            self.classes[name] = FontClass(gids, fname, lineno, generated, editable)
 
     def addGlyphClass(self, name, gid, editable = False) :
+        gid = getattr(gid, 'gid', gid)
         if name not in self.classes :
             self.classes[name] = FontClass()
-        if gid not in self.classes[name].elements :
+        if gid not in self.classes[name] :
             self.classes[name].append(gid)
 
     def addRules(self, rules, index) :
@@ -230,24 +304,64 @@ class Font(object) :
 
     # TODO: move this method to GraideFont, or refactor
     def loadAP(self, apFileName) :
+        # If glyphs are already loaded (eg from a UFO) the AP data is merged into them, matching glyphs by PSName,
+        # and any other glyphs in the AP file are added after them
         if not os.path.exists(apFileName) : return False
-        etree = parse(apFileName)
-        self.initGlyphs(len(etree.getroot())) # guess each child is a glyph
+        merge = any(self.glyphs)
+        if not merge : self.initGlyphs(0)  # grown by addGlyph as glyphs are read
+        context = iterparse(apFileName, events = ('start', 'end'))
+        event, root = next(context)
         i = 0
-        for e in etree.getroot().iterfind("glyph") :
-            g = self.addGlyph(i, e.get('PSName'))
-            g.readAP(e, self)
-            i += 1
+        for event, e in context :
+            if event == 'end' and e.tag == 'glyph' :
+                g = self.addGlyph(None if merge else i, e.get('PSName'))
+                g.readAP(e, self)
+                i += 1
+                root.clear()    # drop glyphs already read to keep memory bounded
+        if not merge : self.numRealGlyphs = i
         return True
 
-    def saveAP(self, apFileName, autoGdlFile) :
+    def loadUFO(self, ufont, layer = None) :
+        """Populate the glyph table from a silfont.UFOlib Ufont rather than a compiled font
+        and AP file. Glyphs are ordered by public.glyphOrder, then any others by name"""
+        if layer is None : layer = ufont.deflayer
+        names = set(layer.keys())
+        order = []
+        lib = getattr(ufont, 'lib', None)
+        if lib is not None and 'public.glyphOrder' in lib :
+            for e in lib['public.glyphOrder'][1] :
+                if e.text in names :
+                    order.append(e.text)
+                    names.discard(e.text)
+        order.extend(sorted(names))
+        self.initGlyphs(0)
+        for i, n in enumerate(order) :
+            glif = layer[n]
+            psname = n
+            if glif['lib'] is not None and 'public.postscriptname' in glif['lib'] :
+                psname = glif['lib']['public.postscriptname'][1].text
+            g = self.addGlyph(i, psname)
+            g.readUFO(glif, self)
+        self.numRealGlyphs = len(order)
+        return True
+
+    def saveAP(self, apFileName, autoGdlFile, batch = 256) :
+        # Glyph elements are serialised and discarded a batch at a time; output matches
+        # ElementTree.write of the whole tree (attributes sorted, utf-8 declaration)
         root = Element('font')
-        root.set('upem', str(self.emunits()))
-        root.set('producer', 'graide 1.0')
-        root.text = "\n\n"
-        for g in self.glyphs :
-            if g : g.createAP(root, self, autoGdlFile)
-        ElementTree(root).write(apFileName, encoding="utf-8", xml_declaration=True)
+        with open(apFileName, "wb") as fh :
+            fh.write("<?xml version='1.0' encoding='utf-8'?>\n")
+            fh.write('<font producer="graide 1.0" upem="%s">\n\n' % str(self.emunits()))
+            for g in self.glyphs :
+                if g : g.createAP(root, self, autoGdlFile)
+                if len(root) >= batch : self._flushAP(fh, root)
+            self._flushAP(fh, root)
+            fh.write("</font>")
+
+    def _flushAP(self, fh, root) :
+        if len(root) :
+            fh.write(tostring(root, encoding = "utf-8")[6:-7])    # strip <font> and </font>
+            root.clear()
 
     def createClasses(self) :
         self.subclasses = {}
@@ -277,12 +391,62 @@ class Font(object) :
                     self.points[genericName].addBaseGlyph(g)
                 else :
                     self.points[genericName].addDiaGlyph(g)
+        self.calculateComplementClasses()
+
+    # Work out the cnXDia and cnTakesXDia classes for all point classes in a single pass over the glyphs.
+    # Only diacritics can be in these classes, so only they need testing against each point class.
+    def calculateComplementClasses(self) :
+        points = self.points.values()
+        for p in points :
+            p.notDias = []
+            p.notGlyphs = []
+        for g in self.glyphs :
+            if not g or not g.isDia : continue
+            for p in points :
+                if g not in p.diaSet :
+                    p.notDias.append(g)
+                    if g not in p.glyphSet : p.notGlyphs.append(g)
     
-    def calculateOTLookups(self) :
-        if self.font :
+    def calculateOTLookups(self, cacheFile = None, processes = 1) :
+        if not self.font : return
+        results = None
+        if cacheFile :
+            key = self.otCacheKey()
+            results = self.readOTCache(cacheFile, key)
+        if results is None :
+            results = LookupResults(self)
             for t in ('GSUB', 'GPOS') :
                 if t in self.font :
-                    self.font[t].table.LookupList.process(self)
+                    self.font[t].table.LookupList.process(results, processes)
+            if cacheFile : self.writeOTCache(cacheFile, key, results)
+        results.apply(self)
+
+    # The processed lookups depend on the OT tables, the glyph names (post) and
+    # the aliases, plus the GDL names used in the rules, which the AP file can change
+    def otCacheKey(self) :
+        h = hashlib.sha1()
+        tables = self.font.reader.tables if self.font.reader else {}
+        for t in ('GSUB', 'GPOS', 'post') :
+            if t in tables : h.update("%s:%d\n" % (t, tables[t].checkSum))
+        for k, v in sorted(self.aliases.items()) :
+            h.update("%s=%s\n" % (k, v))
+        for g in self.glyphs :
+            if g : h.update("%d %s %s\n" % (g.gid, g.psname, g.GDLName()))
+        return h.hexdigest()
+
+    def readOTCache(self, cacheFile, key) :
+        if not os.path.exists(cacheFile) : return None
+        try :
+            with open(cacheFile, "rb") as f :
+                data = pickle.load(f)
+        except Exception :
+            return None     # treat an unreadable cache as out of date
+        if data.get('key') != key : return None
+        return data['results']
+
+    def writeOTCache(self, cacheFile, key, results) :
+        with open(cacheFile, "wb") as f :
+            pickle.dump({'key' : key, 'results' : results}, f, pickle.HIGHEST_PROTOCOL)
 
     def getPointClasses(self) :
         if len(self.points) == 0 :
@@ -306,15 +470,18 @@ class Font(object) :
                         self.ligs[tn] = [(g.GDLName(), o[0].GDL())]
 
     def outGDL(self, fh, args) :
+        fh = GDLWriter(fh)
+        # classes with the same members (in the same order) are output once and then aliased
+        seen = None if getattr(args, 'nodedup', False) else {}
         munits = self.emunits()
         fh.write('table(glyph) {MUnits = ' + str(munits) + '};\n')
         nglyphs = 0
         for g in self.glyphs :
             if not g or not g.psname : continue
             if g.psname == '.notdef' :
-                fh.write(g.GDLName() + ' = glyphid(0)')
+                line = g.GDLName() + ' = glyphid(0)'
             else :
-               fh.write(g.GDLName() + ' = postscript("' + g.psname + '")')
+                line = g.GDLName() + ' = postscript("' + g.psname + '")'
             outs = []
             if len(g.anchors) :
                 for a in g.anchors.keys() :
@@ -322,22 +489,22 @@ class Font(object) :
                     outs.append(a + "=point(" + str(int(v[0])) + "m, " + str(int(v[1])) + "m)")
             for (p, v) in g.gdl_properties.items() :
                 outs.append("%s=%s" % (p, v))
-            if len(outs) : fh.write(" {" + "; ".join(outs) + "}")
-            fh.write(";\n")
+            if len(outs) : line += " {" + "; ".join(outs) + "}"
+            fh.write(line + ";\n")
             nglyphs += 1
         fh.write("\n")
         fh.write("\n/* Point Classes */\n")
         for p in sorted(self.points.values(), key=lambda x: x.name) :
             if not p.hasDias() : continue
             n = p.name + "Dia"
-            self.outclass(fh, "c" + n, p.classGlyphs(True))
-            self.outclass(fh, "cTakes" + n, p.classGlyphs(False))
-            self.outclass(fh, 'cn' + n, filter(lambda x : p.isNotInClass(x, True), self.glyphs))
-            self.outclass(fh, 'cnTakes' + n, filter(lambda x : p.isNotInClass(x, False), self.glyphs))
+            self.outclass(fh, "c" + n, p.classGlyphs(True), seen)
+            self.outclass(fh, "cTakes" + n, p.classGlyphs(False), seen)
+            self.outclass(fh, 'cn' + n, p.classNotGlyphs(True), seen)
+            self.outclass(fh, 'cnTakes' + n, p.classNotGlyphs(False), seen)
         fh.write("\n/* Classes */\n")
         for c in sorted(self.classes.keys()) : # c = class name, l = class object
             if c not in self.subclasses and not self.classes[c].generated :  # don't output the class to the AP file if it was autogenerated
-                self.outclass(fh, c, self.classes[c].elements)
+                self.outclass(fh, c, self.classes[c].glyphs(self), seen)
         for p in self.subclasses.keys() :
             ins = []
             outs = []
@@ -345,17 +512,18 @@ class Font(object) :
                 ins.append(k)
                 outs.append(v)
             n = p.replace('.', '_')
-            self.outclass(fh, 'cno_' + n, ins)
-            self.outclass(fh, 'c' + n, outs)
+            self.outclass(fh, 'cno_' + n, ins, seen)
+            self.outclass(fh, 'c' + n, outs, seen)
         fh.write("/* Ligature Classes */\n")
         for k in sorted(self.ligs.keys()) :
-            self.outclass(fh, "clig" + k, map(lambda x: self.gdls[x[0]], self.ligs[k]))
-            self.outclass(fh, "cligno_" + k, map(lambda x: self.gdls[x[1]], self.ligs[k]))
+            self.outclass(fh, "clig" + k, map(lambda x: self.gdls[x[0]], self.ligs[k]), seen)
+            self.outclass(fh, "cligno_" + k, map(lambda x: self.gdls[x[1]], self.ligs[k]), seen)
         fh.write("\nendtable;\n")
         fh.write("/* Substitution Rules */\n")
         for k, v in sorted(self.rules.items(), key=lambda x:map(int,x[0].split('_'))) :
             fh.write('\n// lookup ' + k + '\n')
             fh.write('// ' + "\n// ".join(v) + "\n")
+        # Rules converted from lookups are advisory, so are output as comments to be copied into passes by hand
         fh.write("\n/* Positioning Rules */\n")
         for k, v in sorted(self.posRules.items(), key=lambda x:map(int,x[0].split('_'))) :
             fh.write('\n// lookup ' + k + '\n')
@@ -363,6 +531,7 @@ class Font(object) :
         fh.write("\n\n#define MAXGLYPH %d\n\n" % (nglyphs - 1))
         if args.include :
             fh.write("#include \"%s\"\n" % args.include)
+        fh.flush()
 
     def outPosRules(self, fh, num) :
         fh.write("""
@@ -383,25 +552,21 @@ pass(%d);
         fh.write("endpass;\nendtable;\n")
 
 
-    def outclass(self, fh, name, glyphs) :
-        fh.write(name + " = (")
-        count = 1
-        sep = ""
+    def outclass(self, fh, name, glyphs, seen = None) :
+        names = []
         for g in glyphs :
             if not g : continue
-                
-                
             if isinstance(g, basestring) :
-                fh.write(sep + g)
+                names.append(g)
+            elif g.GDLName() is None :
+                print "Can't output " + str(g.gid) + " to class " + name
             else :
-                if g.GDLName() is None :
-                    print "Can't output " + str(g.gid) + " to class " + name
-                else :
-                    fh.write(sep + g.GDLName())
-            if count % 8 == 0 :
-                sep = ',\n         '
-            else :
-                sep = ', '
-            count += 1
-        fh.write(');\n\n')
-
+                names.append(g.GDLName())
+        if seen is not None and len(names) :
+            key = tuple(names)
+            if key in seen :
+                fh.write(name + " = (" + seen[key] + ');\n\n')
+                return
+            seen[key] = name
+        lines = [", ".join(names[i:i+8]) for i in range(0, len(names), 8)]
+        fh.write(name + " = (" + ',\n         '.join(lines) + ');\n\n')
@@ -18,7 +18,7 @@
 #    internet at http://www.fsf.org/licenses/lgpl.html.
 
 import re, traceback
-from silfont.makegdl.psnames import Name
+from silfont.makegdl.psnames import Name, getName
 from xml.etree.cElementTree import SubElement
 
 # Convert from Graphite AP name to the standard name, eg upperM -> _upper
@@ -40,7 +40,8 @@ def ap_gr(txt) :
 
 class Glyph(object) :
 
-    isDia = False
+    __slots__ = ('psname', 'name', 'gdl', 'gid', 'uid', 'comment', 'isDia',
+                 'anchors', 'classes', 'gdl_properties', 'properties')
 
     def __init__(self, name, gid = 0) :
         self.clear()
@@ -78,7 +79,7 @@ class Glyph(object) :
     def parseNames(self) :
         if self.psname :
             for name in self.psname.split("/") :
-                res = Name(name)
+                res = getName(name)
                 yield res
         else :
             yield None
@@ -110,11 +111,29 @@ class Glyph(object) :
         p = elem.find('note')
         if p is not None and p.text :
             self.comment = p.text
+        self.addClasses(font)
+
+    # Read the same information as readAP from a silfont.UFOlib Uglif. Classes are a space
+    # separated string under org.sil.classes in the glif lib, as in the AP classes property
+    def readUFO(self, glif, font) :
+        if len(glif['unicode']) :
+            self.uid = glif['unicode'][0].element.get('hex')
+        for a in glif['anchor'] :
+            e = a.element
+            self.setAnchor(ap_gr(e.get('name')), int(round(float(e.get('x', 0)))), int(round(float(e.get('y', 0)))))
+        if glif['note'] is not None and glif['note'].element.text :
+            self.comment = glif['note'].element.text.strip()
+        lib = glif['lib']
+        if lib is not None and 'org.sil.classes' in lib :
+            self.properties['classes'] = lib['org.sil.classes'][1].text or ""
+        self.addClasses(font)
+
+    def addClasses(self, font) :
         if 'classes' in self.properties :
             for c in self.properties['classes'].split() :
                 if c not in self.classes :
                     self.classes.add(c)
-                    font.addGlyphClass(c, self, editable = True)
+                    font.addGlyphClass(c, self.gid, editable = True)
 
     def createAP(self, elem, font, autoGdlFile) :
         e = SubElement(elem, 'glyph')
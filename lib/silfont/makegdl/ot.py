@@ -17,56 +17,96 @@
 #    suite 500, Boston, MA 02110-1335, USA or visit their web page on the 
 #    internet at http://www.fsf.org/licenses/lgpl.html.
 
-import re, traceback, logging
+import re, sys, traceback, logging, multiprocessing
 from fontTools.ttLib.tables import otTables
 
-def compress_strings(strings) :
-    '''If we replace one column in the string with different lists, can we reduce the number
-       of strings? Each string is a tuple of the string and a single value that will be put into
-       a class as well when list compression occurs'''
-    maxlen = max(map(lambda x: len(x[0]), strings))
-    scores = []
-    for r in range(maxlen) :
-        allchars = {}
-        count = 0
-        for s in strings :
-            if r >= len(s[0]) : continue
-            c = tuple(s[0][0:r] + (s[0][r+1:] if r < len(s[0]) - 1 else []))
-            if c in allchars :
-                allchars[c] += 1
-            else :
-                allchars[c] = 0
-            count += 1
-        scores.append((max(allchars.values()), len(allchars), count))
-    best = maxlen
-    bestr = 0
-    for r in range(maxlen) :
-        score = maxlen - (scores[r][2] - scores[r][1])
-        if score < best :
-            best = score
-            bestr = r
-    numstrings = len(strings)
-    i = 0
-    allchars = {}
-    while i < len(strings) :
-        s = strings[i][0]
-        if bestr >= len(s) :
-            i += 1
+def _collapse_column(rows, r, classvalues, matchcols) :
+    '''Merge rows that differ only in column r, making a class of that column. Each row is a
+       tuple (string, value, col) where string is a tuple of glyphs or classes (tuples of glyphs)
+       and col is the column a list of values is aligned with, or None if the value is a single glyph.
+       When aligning values with a column, the side that is matched (the column if matchcols is set,
+       else the values) must have no repeated glyphs, while the other side may.'''
+    groups = {}
+    res = []
+    for row in rows :
+        s, v, col = row
+        if r >= len(s) or col == r :
+            res.append(row)
             continue
-        c = tuple(s[0:bestr] + (s[bestr+1:] if bestr < len(s) - 1 else []))
-        if c in allchars :
-            allchars[c][1].append(s[bestr])
-            allchars[c][2].append(strings[i][1])
-            strings.pop(i)
+        if col is None and classvalues :
+            key = (s[:r] + s[r+1:], None)
+        else :
+            key = (s[:r] + s[r+1:], v, col)
+        g = groups.get(key, None)
+        if g is None :
+            g = [row]
+            groups[key] = g
+            res.append(g)
         else :
-            allchars[c] = [i, [s[bestr]], [strings[i][1]]]
-            i += 1
-    for v in allchars.values() :
-        if len(set(v[1])) != 1 :    # if all values in the list identical, don't output list
-            strings[v[0]][0][bestr] = v[1]
-        if len(v[2]) > 1 :          # don't need a list if length 1
-            strings[v[0]][1] = v[2]
-    return strings
+            g.append(row)
+    if len(res) == len(rows) : return rows
+
+    newrows = []
+    for g in res :
+        if isinstance(g, tuple) or len(g) == 1 :
+            newrows.append(g if isinstance(g, tuple) else g[0])
+            continue
+        s, v, col = g[0]
+        if col is None :
+            values = set(x[1] for x in g)
+            if len(values) > 1 :
+                cols = [x[0][r] for x in g]
+                matched = cols if matchcols else [x[1] for x in g]
+                if classvalues and len(set(matched)) == len(matched) and not any(isinstance(c, tuple) for c in cols) :
+                    newrows.append((s[:r] + (tuple(cols),) + s[r+1:], tuple(x[1] for x in g), r))
+                    continue
+                # Can't align the values with the column, so only merge rows with the same value
+                subgroups = {}
+                for x in g :
+                    if x[1] in subgroups :
+                        subgroups[x[1]].append(x)
+                    else :
+                        subgroups[x[1]] = [x]
+                        newrows.append(subgroups[x[1]])
+                continue
+        newrows.append(g)
+    return [x if isinstance(x, tuple) else _merge_rows(x, r) for x in newrows]
+
+def _merge_rows(g, r) :
+    if len(g) == 1 : return g[0]
+    s, v, col = g[0]
+    members = []
+    seen = set()
+    for x in g :
+        c = x[0][r]
+        for m in (c if isinstance(c, tuple) else (c,)) :
+            if m not in seen :
+                seen.add(m)
+                members.append(m)
+    c = tuple(members) if len(members) > 1 else members[0]
+    return (s[:r] + (c,) + s[r+1:], v, col)
+
+def compress_strings(strings, classvalues = True, matchcols = True) :
+    '''Reduce the number of strings by replacing columns in them with classes. Each string is a pair
+       of the string (a list of glyphs) and a value. Rows that differ only in one column are merged,
+       choosing the column that removes the most rows each time, until nothing more can be merged.
+       If classvalues is set, rows with different values can be merged into one row with a list of
+       values aligned with the class column. matchcols says whether the strings (as for LigatureSubst)
+       or the values (as for MultipleSubst) are what is matched, so must not repeat glyphs when aligned.
+       Each returned row is [string, value, col] where col is
+       the index of the column that a list value is aligned with, or None.'''
+    rows = [(tuple(s[0]), s[1], None) for s in strings]
+    if not len(rows) : return []
+    maxlen = max(len(x[0]) for x in rows)
+    while True :
+        best = rows
+        for r in range(maxlen) :
+            res = _collapse_column(rows, r, classvalues, matchcols)
+            if len(res) < len(best) : best = res
+        if best is rows : break
+        rows = best
+    return [[[list(c) if isinstance(c, tuple) else c for c in s], list(v) if isinstance(v, tuple) else v, col]
+                for s, v, col in rows]
 
 def make_rule(left, right = None, before = None, after = None) :
     res = " ".join(map(lambda x: x or "_", left))
@@ -85,7 +125,7 @@ def add_class_classes(font, name, ctable) :
     for k, v in ctable.classDefs.items() :
         if v not in vals : vals[v] = []
         vals[v].append(k)
-    numk = max(vals.keys())
+    numk = max(vals.keys()) if len(vals) else 0
     res = [None] * (numk + 1)
     for k, v in vals.items() :
         if len(v) > 1 :
@@ -95,20 +135,90 @@ def add_class_classes(font, name, ctable) :
             res[k] = font.glyph(v[0]).GDLName()
     return res
 
+# OT value record fields and the GDL assignment for each. An OT advance is an adjustment, so is added
 vrgdlmap = {
-    'XPlacement' : 'shift.x',
-    'YPlacement' : 'shift.y',
-    'XAdvance' : 'advance'
+    'XPlacement' : 'shift.x=',
+    'YPlacement' : 'shift.y=',
+    'XAdvance' : 'advance.x+='
 }
 def valuerectogdl(vr) :
     res = "{"
     for k, v in vrgdlmap.items() :
         if hasattr(vr, k) :
-            res += "{}={}; ".format(v, getattr(vr, k))
+            res += "{}{}; ".format(v, getattr(vr, k))
     res = res[:-1] + "}"
     if len(res) == 1 : return ""
     return res
 
+def make_pairrule(first, v1, second, v2) :
+    return " ".join(filter(None, [first, v1, second, v2])) + ";"
+
+class _GlyphRef(object) :
+    # Stands in for a Glyph while lookups are processed, recording any anchors set on it
+
+    def __init__(self, glyph, results) :
+        self.glyph = glyph
+        self.results = results
+
+    def GDLName(self) :
+        return self.glyph.GDLName()
+
+    def setAnchor(self, name, x, y, t = None) :
+        self.results.anchors.append((self.glyph.gid, name, x, y))
+        return True
+
+class LookupResults(object) :
+    '''Collects the classes, rules and anchors produced by processing OT lookups. It is passed to
+       the process methods in place of the Font, and holds glyphs by gid so that the results can be
+       cached and then applied to a Font using apply()'''
+
+    def __init__(self, font = None) :
+        self.font = font
+        self.classes = []       # (name, [gid, ...]) in the order they were added
+        self.rules = {}
+        self.posRules = {}
+        self.anchors = []       # (gid, name, x, y) in the order they were set
+
+    def __getstate__(self) :
+        res = dict(self.__dict__)
+        res['font'] = None
+        return res
+
+    def alias(self, s) :
+        return self.font.alias(s)
+
+    def glyph(self, name) :
+        g = self.font.glyph(name)
+        if g is None : return None
+        return _GlyphRef(g, self)
+
+    def addClass(self, name, elements, fname = None, lineno = 0, generated = False, editable = False) :
+        if name :
+            self.classes.append((name, map(lambda x: x.glyph.gid if x else None, elements)))
+
+    def addRules(self, rules, index) :
+        self.rules[index] = rules
+
+    def addPosRules(self, rules, index) :
+        self.posRules[index] = rules
+
+    def merge(self, other) :
+        self.classes.extend(other.classes)
+        self.rules.update(other.rules)
+        self.posRules.update(other.posRules)
+        self.anchors.extend(other.anchors)
+
+    def apply(self, font) :
+        for name, gids in self.classes :
+            font.addClass(name, gids)
+        for k, v in self.rules.items() :
+            font.addRules(v, k)
+        for k, v in self.posRules.items() :
+            font.addPosRules(v, k)
+        for gid, name, x, y in self.anchors :
+            g = font[gid]
+            if g : g.setAnchor(name, x, y)
+
 def _add_method(*clazzes):
     """Returns a decorator function that adds a new method to one or
     more classes."""
@@ -131,10 +241,36 @@ def process(self, font, index) :
         else :
             logging.warning("No processing of {} {}_{}".format(str(s), index, i))
 
+# The Font and lookups being processed, inherited by forked worker processes
+_poolstate = None
+
+def _process_lookup(i) :
+    font, lookups = _poolstate
+    res = LookupResults(font)
+    lookups[i].process(res, str(i))
+    return res
+
 @_add_method(otTables.LookupList)
-def process(self, font) :
-    for i, s in enumerate(self.Lookup) :
-        s.process(font, str(i))
+def process(self, font, processes = 1) :
+    '''Process each lookup. If font is a LookupResults and processes > 1, the lookups are shared out
+       across a pool of worker processes, each producing its own LookupResults. These are merged
+       in lookup order, so the end result is the same as processing them one after another.
+       Relies on fork to give the workers the font, so is always serial on Windows.'''
+    if processes > 1 and len(self.Lookup) > 1 and hasattr(font, 'merge') and sys.platform != 'win32' :
+        global _poolstate
+        _poolstate = (font.font, self.Lookup)
+        pool = multiprocessing.Pool(min(processes, len(self.Lookup)))
+        try :
+            results = pool.map(_process_lookup, range(len(self.Lookup)), 1)
+        finally :
+            pool.close()
+            pool.join()
+            _poolstate = None
+        for r in results :
+            font.merge(r)
+    else :
+        for i, s in enumerate(self.Lookup) :
+            s.process(font, str(i))
 
 @_add_method(otTables.ExtensionSubst, otTables.ExtensionPos)
 def process(self, font, index) :
@@ -160,7 +296,7 @@ def process(self, font, index) :
     strings = []
     for i in range(nums) :
         strings.append([self.Sequence[i].Substitute, self.Coverage.glyphs[i]])
-    res = compress_strings(strings)
+    res = compress_strings(strings, matchcols = False)   # the output sequences can repeat glyphs
     count = 0
     rules = []
     for r in res :
@@ -197,22 +333,27 @@ def process(self, font, index) :
     for r in res :
         rule = ""
         besti = 0
+        numclasses = len(filter(lambda x: hasattr(x, '__iter__'), r[0]))
         for i, c in enumerate(r[0]) :
             if hasattr(c, '__iter__') :
-                lname = font.alias(cname+"l{}".format(count))
+                if numclasses == 1 :
+                    lname = font.alias(cname+"l{}".format(count))
+                else :
+                    lname = font.alias(cname+"l{}_{}".format(count, i))
                 font.addClass(lname, map(font.glyph, c))
                 rule += lname + " "
                 besti = i
             else :
                 rule += font.glyph(c).GDLName() + " "
+        if r[2] is not None : besti = r[2]    # output class must line up with the input class it maps from
         rule += "> " + "_ " * besti
         if hasattr(r[1], '__iter__') :
             rname = font.alias(cname+"r{}".format(count))
             font.addClass(rname, map(font.glyph, r[1]))
             rule += rname
-            count += 1
         else :
             rule += font.glyph(r[1]).GDLName()
+        if numclasses or hasattr(r[1], '__iter__') : count += 1
         rule += " _" * (len(r[0]) - 1 - besti) + ";"
         rules.append(rule)
     font.addRules(rules, index)
@@ -282,7 +423,61 @@ def process(self, font, index) :
 
 @_add_method(otTables.PairPos)
 def process(self, font, index) :
-    pass
+    cname = "cot_k{}".format(index)
+    if not len(font.alias(cname)) : return
+    rules = []
+    if self.Format == 1 :
+        strings = []
+        values = []     # distinct (first, second) GDL adjustments; strings hold the index of theirs
+        vindex = {}
+        for i, g in enumerate(self.Coverage.glyphs) :
+            for r in self.PairSet[i].PairValueRecord :
+                # Zero valued pairs are kept, since they are exceptions that stop later subtables applying
+                v = (valuerectogdl(getattr(r, 'Value1', None)), valuerectogdl(getattr(r, 'Value2', None)))
+                if v not in vindex :
+                    vindex[v] = len(values)
+                    values.append(v)
+                strings.append([[g, r.SecondGlyph], vindex[v]])
+        # Only merge pairs with the same adjustments, since GDL can't index values by class
+        res = compress_strings(strings, classvalues = False)
+        count = 0
+        for r in res :
+            names = []
+            for c, n in zip(r[0], ("l", "r")) :
+                if hasattr(c, '__iter__') :
+                    cn = font.alias(cname + n + "{}".format(count))
+                    font.addClass(cn, map(font.glyph, c))
+                    names.append(cn)
+                else :
+                    names.append(font.glyph(c).GDLName())
+            if any(map(lambda x: hasattr(x, '__iter__'), r[0])) : count += 1
+            v1, v2 = values[r[1]]
+            rules.append(make_pairrule(names[0], v1, names[1], v2))
+    elif self.Format == 2 :
+        flist = add_class_classes(font, cname+"l", self.ClassDef1)
+        # Glyphs in the coverage but not in ClassDef1 are in class 0
+        cls0 = filter(lambda x: x not in self.ClassDef1.classDefs, self.Coverage.glyphs)
+        if len(cls0) > 1 :
+            flist[0] = font.alias(cname+"l0")
+            font.addClass(flist[0], map(font.glyph, cls0))
+        elif len(cls0) :
+            flist[0] = font.glyph(cls0[0]).GDLName()
+        slist = add_class_classes(font, cname+"r", self.ClassDef2)
+        for i, c1 in enumerate(self.Class1Record) :
+            if i >= len(flist) or flist[i] is None : continue
+            for j, c2 in enumerate(c1.Class2Record) :
+                v1 = getattr(c2, 'Value1', None)
+                v2 = getattr(c2, 'Value2', None)
+                if j == 0 :  # class 0 is every glyph not in ClassDef2, so can't be expressed as a class
+                    if any(getattr(v, k, 0) for v in (v1, v2) for k in vrgdlmap) :
+                        logging.warning("No processing of class 0 kerning in {} for class {}".format(index, i))
+                    continue
+                if j >= len(slist) :
+                    logging.warning("Second class {} is out of range for ClassDef2 in {} for class {}".format(j, index, i))
+                    continue
+                if slist[j] is None : continue  # No glyphs in the class
+                rules.append(make_pairrule(flist[i], valuerectogdl(v1), slist[j], valuerectogdl(v2)))
+    font.addPosRules(rules, index)
 
 @_add_method(otTables.CursivePos)
 def process(self, font, index) :
@@ -4353,7 +4353,32 @@ def parse(name) :
     res = []
     return res
 
+# Regular expressions used when parsing and converting names
+_uniRe = re.compile(r"^uni[0-9A-Fa-f]{4}")
+_uniCompRe = re.compile(r"[0-9A-Fa-f]{4}")
+_uRe = re.compile(r"^u?[0-9A-Fa-f]{4,6}$")
+_capsRe = re.compile(r"([A-Z])")
+
+def _lowerCaps(m) :
+    return "_" + m.group(1).lower()
+
+# Interned Name objects, keyed by psname. The objects are shared, so callers must not modify them.
+_nameCache = {}
+
+def getName(psname) :
+    """Return the parsed Name for psname, only parsing it the first time it is seen"""
+    res = _nameCache.get(psname, None)
+    if res is None :
+        res = Name(psname)
+        if psname : _nameCache[psname] = res
+    return res
+
+def clearNameCache() :
+    _nameCache.clear()
+
 class Name(object) :
+    __slots__ = ('psname', 'components', 'ext', 'cname', 'GDLName', 'finalcomp')
+
     def __init__(self, name = None, finalcomp = False) :
         self.psname = name
         self.components = []
@@ -4371,11 +4396,11 @@ class Name(object) :
                 mod = None
             else :
                 mod = mod.split(".")
-            if re.match(r"^uni[0-9A-Fa-f]{4}", base) :
-                self.components.extend((int(x, 16), None) for x in re.findall(r"[0-9A-Fa-f]{4}", base))
+            if _uniRe.match(base) :
+                self.components.extend((int(x, 16), None) for x in _uniCompRe.findall(base))
                 if mod :
                     self.components[-1] = (self.components[-1][0], mod)
-            elif re.match(r"^u?[0-9A-Fa-f]{4,6}$", base) :
+            elif _uRe.match(base) :
                 if base[0] == 'u' :
                     self.components.append((int(base[1:], 16), mod))
                 else :
@@ -4459,7 +4484,7 @@ class Name(object) :
                 return None
                 
             res = "g_" + self.psname.replace('.', '_')
-            self.GDLName = re.sub(r"([A-Z])", lambda x : "_" + x.group(1).lower(), res)
+            self.GDLName = _capsRe.sub(_lowerCaps, res)
             return self.GDLName
             
         for k in self.components :
@@ -4473,7 +4498,7 @@ class Name(object) :
                 pass
             elif n in uniToPsnameMap :
                 if not res : res = "g_"
-                res += re.sub("([A-Z])", lambda x : "_" + x.group(1).lower(), uniToPsnameMap[n])
+                res += _capsRe.sub(_lowerCaps, uniToPsnameMap[n])
             elif not res :
                 res = "g" + n.lower()
             else :
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+'''Compact kerning by replacing kerning groups and pairs with ones giving the same kerning with fewer pairs
+  - existing kerning groups are kept, and other glyphs with identical kerning are put into new kerning groups
+  - the font is not changed if the compacted kerning would not be smaller (pairs plus group members)
+  - with -n the compacted form is just reported in the log and the font is not changed'''
+__url__ = 'http://github.com/silnrsi/pysilfont'
+__copyright__ = 'Copyright (c) 2015, SIL International  (http://www.sil.org)'
+__license__ = 'Released under the MIT License (http://opensource.org/licenses/MIT)'
+__author__ = 'David Raymond'
+__version__ = '0.0.1'
+
+from silfont.UFOlib import *
+
+suffix = "_compactKern"
+argspec = [
+    ('ifont',{'help': 'Input font file'}, {'type': 'infont'}),
+    ('ofont',{'help': 'Output font file','nargs': '?' }, {'type': 'outfont'}),
+    ('-n','--nochange',{'help': 'Report the compacted kerning without changing the font', 'action': 'store_true'}, {}),
+    ('-l','--log',{'help': 'Log file'}, {'type': 'outfile', 'def': suffix+'.log'})]
+
+def doit(args) :
+    font = args.ifont
+    logger = font.logger
+    kerning = font.kerningIndex()
+
+    oldgroups = kerning.groupSides()
+    oldpairs = sum(len(seconds) for seconds in kerning.kerning.itervalues())
+    oldsize = oldpairs + sum(len(kerning.groups[group]) for group in oldgroups)
+    (groups, pairs) = kerning.compacted()
+    newpairs = sum(len(seconds) for seconds in pairs.itervalues())
+    newsize = newpairs + sum(len(glyphs) for glyphs in groups.itervalues())
+
+    if newsize >= oldsize :
+        logger.log("Compacted kerning would not be smaller so kerning is unchanged", "P")
+        return None
+    for group in sorted(groups) :
+        if group not in oldgroups : logger.log("New kerning group " + group + ": " + " ".join(groups[group]), "I")
+    logger.log("Kerning pairs: %d before, %d after compaction" % (oldpairs, newpairs), "P")
+    logger.log("Kerning groups: %d before, %d after compaction" % (len(oldgroups), len(groups)), "P")
+    logger.log("Kerning pairs plus group members: %d before, %d after compaction" % (oldsize, newsize), "P")
+
+    if args.nochange : return None
+    kerning.setKerning(groups, pairs)
+    return font
+
+execute("PSFU",doit, argspec)
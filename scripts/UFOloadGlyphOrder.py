@@ -18,23 +18,19 @@ argspec = [
 def doit(args) :
     font = args.ifont
     infile = args.input
-    glyphlist = font.deflayer.keys() # List to check every glyph has a record in the list
-
-    array = ET.Element("array")
-
-    for glyphn in infile.readlines() :
-        glyphn = glyphn.strip()
-        if glyphn == "" or glyphn[0] == "#" : continue
-        # Add to array
-        sub = ET.SubElement(array,"string")
-        sub.text = glyphn
-        # Check to see if glyph is in font
-        if glyphn in glyphlist :
-            glyphlist.remove(glyphn) # So glyphlist ends up with those without an entry
-        else :
-            font.logger.log("No glyph in font for " + glyphn,"I")
-
-    for glyphn in glyphlist : # Remaining glyphs were not in the input file
+
+    glyphorder = []
+
+    def rows() :
+        for glyphn in infile.readlines() :
+            glyphn = glyphn.strip()
+            if glyphn == "" or glyphn[0] == "#" : continue
+            glyphorder.append(glyphn)
+            yield (glyphn, []) # No glyph lib values to set; just check every glyph has a record in the list
+
+    uncovered = font.deflayer.setLibValues(rows(), unmatched = lambda glyphn : font.logger.log("No glyph in font for " + glyphn,"I"))
+
+    for glyphn in sorted(uncovered) : # Remaining glyphs were not in the input file
         font.logger.log("No entry in input file for font glyph " + glyphn,"I")
 
     # Add to lib.plist
@@ -42,7 +38,7 @@ def doit(args) :
         font.lib = Uplist(font = font)
         font.dtree['lib.plist'] = dirTreeItem(read = True, added = True, fileObject = font.lib, fileType = "xml")
         font.lib.etree = ET.fromstring("<plist>\n<dict/>\n</plist>")
-    font.lib.setelem("public.glyphOrder",array)
+    font.lib.setnative("public.glyphOrder",glyphorder)
 
     return font
 
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+'''Rename glyphs throughout a UFO based on a csv file
+  - csv format oldname,newname
+  - glyphs are renamed in all layers along with component references, public.glyphOrder, public.postscriptNames,
+    groups, kerning and features.fea'''
+__url__ = 'http://github.com/silnrsi/pysilfont'
+__copyright__ = 'Copyright (c) 2015, SIL International  (http://www.sil.org)'
+__license__ = 'Released under the MIT License (http://opensource.org/licenses/MIT)'
+__author__ = 'David Raymond'
+__version__ = '0.0.1'
+
+from silfont.UFOlib import *
+
+suffix = "_renameGlyphs"
+argspec = [
+    ('ifont',{'help': 'Input font file'}, {'type': 'infont'}),
+    ('ofont',{'help': 'Output font file','nargs': '?' }, {'type': 'outfont'}),
+    ('-i','--input',{'help': 'Input csv file'}, {'type': 'incsv', 'def': suffix+'.csv'}),
+    ('-l','--log',{'help': 'Log file'}, {'type': 'outfile', 'def': suffix+'.log'})]
+
+def doit(args) :
+    font = args.ifont
+    incsv = args.input
+    incsv.numfields = 2
+    incsv.logger = font.logger
+
+    mapping = {}
+    for line in incsv :
+        (old, new) = line
+        if old in mapping :
+            font.logger.log("Duplicate entry for " + old + " on line " + str(incsv.line_num) + " ignored", "E")
+            continue
+        mapping[old] = new
+
+    for old in sorted(mapping) :
+        if old not in font.deflayer : font.logger.log("No glyph in font for " + old + "; other references will still be renamed", "I")
+    font.renameGlyphs(mapping)
+
+    return font
+
+execute("PSFU",doit, argspec)
@@ -22,32 +22,20 @@ def doit(args) :
     incsv.minfields = 2
     incsv.maxfields = 3
     incsv.logger = font.logger
-    glyphlist = font.deflayer.keys() # Identify which glifs have not got an AssocFeat set
-
-    for line in incsv :
-        glyphn = line[0]
-        feature = line[1]
-        value = line[2] if len(line) == 3 else ""
-
-        if glyphn in glyphlist :
-            glyph = font.deflayer[glyphn]
-            if glyph["lib"] is None : glyph.add("lib")
-            glyph["lib"].setval("org.sil.assocFeature","string",feature)
-            if value is not "" :
-                glyph["lib"].setval("org.sil.assocFeatureValue","integer",value)
-            else :
-                if "org.sil.assocFeatureValue" in glyph["lib"] : glyph["lib"].remove("org.sil.assocFeatureValue")
-            glyphlist.remove(glyphn)
-        else :
-            font.logger.log("No glyph in font for " + glyphn + " on line " + str(incsv.line_num),"E")
-
-    for glyphn in glyphlist : # Remove any values from remaining glyphs
-        glyph = font.deflayer[glyphn]
-        if glyph["lib"] :
-            if "org.sil.assocFeatureValue" in glyph["lib"] : glyph["lib"].remove("org.sil.assocFeatureValue")
-            if "org.sil.assocFeature" in glyph["lib"] :
-                glyph["lib"].remove("org.sil.assocFeature")
-                font.logger.log("Feature info removed for " + glyphn,"I")
+
+    def nomatch(glyphn) :
+        font.logger.log("No glyph in font for " + glyphn + " on line " + str(incsv.line_num),"E")
+
+    def rows() :
+        for line in incsv :
+            value = line[2] if len(line) == 3 else ""
+            yield (line[0], [("org.sil.assocFeature", ("string", line[1])),
+                ("org.sil.assocFeatureValue", ("integer", value) if value != "" else None)])
+
+    uncovered = font.deflayer.setLibValues(rows(), ["org.sil.assocFeatureValue", "org.sil.assocFeature"], nomatch)
+
+    for glyphn in sorted(uncovered) : # Values have been removed from glyphs with no entry
+        if "org.sil.assocFeature" in uncovered[glyphn] : font.logger.log("Feature info removed for " + glyphn,"I")
 
     return font
 
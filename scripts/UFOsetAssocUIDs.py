@@ -21,29 +21,15 @@ def doit(args) :
     incsv = args.input
     incsv.minfields = 2
     incsv.logger = font.logger
-    glyphlist = font.deflayer.keys() # Identify which glifs have not got AssocUIDs set
-
-    for line in incsv :
-        glyphn = line.pop(0)
-        if glyphn in glyphlist :
-            glyph = font.deflayer[glyphn]
-            if glyph["lib"] is None : glyph.add("lib")
-            # Create an array element for the UID value(s)
-            array = ET.Element("array")
-            for UID in line:
-                sub = ET.SubElement(array,"string")
-                sub.text = UID
-            glyph["lib"].setelem("org.sil.assocUIDs",array)
-            glyphlist.remove(glyphn)
-        else :
-            font.logger.log("No glyph in font for " + glyphn + " on line " + str(incsv.line_num),"E")
-
-    for glyphn in glyphlist : # Remove any values from remaining glyphs
-        glyph = font.deflayer[glyphn]
-        if glyph["lib"] :
-            if "org.sil.assocUIDs" in glyph["lib"] :
-                glyph["lib"].remove("org.sil.assocUIDs")
-                font.logger.log("UID info removed for " + glyphn,"I")
+
+    def nomatch(glyphn) :
+        font.logger.log("No glyph in font for " + glyphn + " on line " + str(incsv.line_num),"E")
+
+    rows = ((line[0], [("org.sil.assocUIDs", line[1:])]) for line in incsv) # UID value(s) are stored as an array
+    uncovered = font.deflayer.setLibValues(rows, ["org.sil.assocUIDs"], nomatch)
+
+    for glyphn in sorted(uncovered) : # Values have been removed from glyphs with no entry
+        if uncovered[glyphn] : font.logger.log("UID info removed for " + glyphn,"I")
 
     return font
 
@@ -21,24 +21,14 @@ def doit(args) :
     incsv = args.input
     incsv.numfields = 2
     incsv.logger = font.logger
-    glyphlist = font.deflayer.keys() # List to check every glyph has a psname applied
-
-    for line in incsv :
-        glyphn = line[0]
-        psname = line[1]
-
-        if glyphn in glyphlist :
-            glyph = font.deflayer[glyphn]
-            if glyph["lib"] is None : glyph.add("lib")
-            glyph["lib"].setval("public.postscriptname","string",psname)
-            glyphlist.remove(glyphn)
-        else :
-            font.logger.log("No glyph in font for " + glyphn  + " on line " + str(incsv.line_num), "I")
-
-    for glyphn in glyphlist : # Remaining glyphs for which no psname was supplied
-        glyph = font.deflayer[glyphn]
-        if glyph["lib"] :
-            if "public.postscriptname" in glyph["lib"] : glyph["lib"].remove("public.postscriptname")
+
+    def nomatch(glyphn) :
+        font.logger.log("No glyph in font for " + glyphn  + " on line " + str(incsv.line_num), "I")
+
+    rows = ((line[0], [("public.postscriptname", ("string", line[1]))]) for line in incsv)
+    uncovered = font.deflayer.setLibValues(rows, ["public.postscriptname"], nomatch)
+
+    for glyphn in sorted(uncovered) : # Glyphs for which no psname was supplied; any existing psname has been removed
         font.logger.log("No PS name in input file for font glyph " + glyphn,"I")
 
     return font
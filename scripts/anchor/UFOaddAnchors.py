@@ -26,27 +26,36 @@ def doit(args) :
     glyphcount = 0
 
     try:
-        for g in ET.parse(args.anchorinfo).getroot().findall('glyph'): ###
+        # Stream the file, clearing each glyph element once processed, so memory use does not grow with file size
+        context = ET.iterparse(args.anchorinfo, events=('start', 'end'))
+        event, root = next(context)
+        for event, g in context:
+            if event != 'end' or g.tag != 'glyph': continue
             glyphcount += 1
             gname = g.get('PSName')
-            if gname not in infont.deflayer.keys():
+            if gname not in infont.deflayer:
                 infont.logger.log("glyph element number " + str(glyphcount) + ": " + gname + " not in font, so skipping anchor data", "W")
+                root.clear()
                 continue
             # anchors currently in font for this glyph
             glyph = infont.deflayer[gname]
             anchorsinfont = set([ ( a.element.get('name'),a.element.get('x'),a.element.get('y') ) for a in glyph['anchor']])
-            # anchors in XML file to be added
-            anchorstoadd = set()
+            # anchors in XML file to be added, in file order
+            anchorstoadd = []
+            seen = set()
             for p in g.findall('point'):
                 name = p.get('type')
                 x = p[0].get('x')               # assume subelement location is first child
                 y = p[0].get('y')
                 if name and x and y:
-                    anchorstoadd.add( (name,x,y) )
+                    if (name,x,y) not in seen:
+                        seen.add( (name,x,y) )
+                        anchorstoadd.append( (name,x,y) )
                 else:
-                    infont.logger.log("Incomplete information for anchor '" + name + "' for glyph " + gname, "E")
+                    infont.logger.log("Incomplete information for anchor '" + str(name) + "' for glyph " + gname, "E")
+            root.clear()
             # compare sets
-            if anchorstoadd == anchorsinfont:
+            if seen == anchorsinfont:
                 if len(anchorstoadd) > 0:
                     infont.logger.log("Anchors in file already in font for glyph " + gname + ": " + str(anchorstoadd), "V")
                 else:
@@ -54,15 +63,8 @@ def doit(args) :
             else:
                 infont.logger.log("Anchors in file for glyph " + gname + ": " + str(anchorstoadd), "I")
                 infont.logger.log("Anchors in font for glyph " + gname + ": " + str(anchorsinfont), "I")
-                for name,x,y in anchorstoadd:
-                    # if anchor being added exists in font already, delete it first
-                    ancnames = [a.element.get('name') for a in glyph['anchor']]
-                    infont.logger.log(str(ancnames), "V") ###
-                    if name in ancnames:
-                        infont.logger.log("removing anchor " + name + ", index " + str(ancnames.index(name)), "V") ###
-                        glyph.remove('anchor', ancnames.index(name))
-                    infont.logger.log("adding anchor " + name + ": (" + x + ", " + y + ")", "V") ###
-                    glyph.add('anchor', {'name': name, 'x': x, 'y': y})
+                # replace any anchors of the same name in font, and add the rest
+                glyph.setAnchors(anchorstoadd)
         # If analysis only, return without writing output font
         if args.analysis: return
         # Return changed font and let execute() write it out
@@ -7,8 +7,10 @@ __author__ = 'David Rowe'
 __version__ = '0.2.0'
 
 from xml.etree import ElementTree as ET
+import os, json, hashlib, heapq
 from silfont.genlib import execute
 from silfont.UFOlib import * ### had error when specifying only: Ufont, Uglif, Ucomponent
+from silfont.UFOlib import _numval
 from silfont.complib import CompGlyph
 
 argspec = [
@@ -18,6 +20,7 @@ argspec = [
     ('-l','--log',{'help': 'Log file'}, {'type': 'outfile', 'def': '_CD.log'}),
     ('-a','--analysis',{'help': 'Analysis only; no output font generated', 'action': 'store_true'},{}),
     ('-f','--force',{'help': 'Force overwrite of glyphs having outlines', 'action': 'store_true'},{}),
+    ('-c','--cache',{'help': 'Cache file used to skip composites whose definition and components are unchanged'},{}),
     # 'choices' for -r should correspond to infont.logger.loglevels.keys() ### -r may move to UFOlib eventually
     ('-r','--report',{'help': 'Set reporting level for log', 'type':str, 'choices':['X','S','E','P','W','I','V']},{})
     ]
@@ -46,11 +49,152 @@ def addtolist(e, prevglyph):
     for se in subelementlist:
         addtolist(se, thisglyphname)
 
-def addtwo(a1, a2):
-    """Take two items (string, number or None), convert to integer and return sum"""
-    b1 = int(a1) if a1 is not None else 0
-    b2 = int(a2) if a2 is not None else 0
-    return b1 + b2
+class GlyphData(dict):
+    """Numeric data used in positioning composites, read from a layer as each glyph is first used:
+    {glyph name: (advance, {anchor name: (x,y)}, components)}, where components is a list of
+    (base, xOffset, yOffset) if the glyph has only components in its outline, otherwise None.
+    Remove a glyph's entry when the glyph is replaced so that it is read again"""
+    def __init__(self, layer):
+        super(GlyphData, self).__init__()
+        self.layer = layer
+
+    def __missing__(self, name):
+        if name not in self.layer: raise KeyError(name)
+        glyph = self.layer[name]
+        outline = glyph['outline']
+        components = None
+        if outline and outline.components and not outline.contours:
+            components = [(c.element.get('base'), _numval(c.element.get('xOffset', 0)), _numval(c.element.get('yOffset', 0)))
+                for c in outline.components]
+        data = self[name] = (glyph.advanceWidth(), glyph.anchorMap(), components)
+        return data
+
+def positioncomposite(glyphlist, glyphdata, lsb, rsb, adv, logger, targetglyphname, removeused=True, flatten=True):
+    """Position the components of a composite from its glyphlist (see addtolist) using the numbers in glyphdata.
+    Returns (advance, [(base, xOffset, yOffset)], {anchor name: (x,y)}, complete),
+    where complete is False if any errors were logged"""
+    complete = True
+    xbase = xadvance = lsb
+    components = []
+    anchors = {} # dictionary of {name: (xOffset,yOffset)}
+    for currglyph, prevglyph, baseAP, diacAP, shiftx, shifty in glyphlist:
+        try:
+            cgadv, cganc, cgcomps = glyphdata[currglyph]
+        except KeyError:
+            logger.log(currglyph + " not found in font", "E")
+            complete = False
+            continue
+        diacAPx = diacAPy = 0
+        baseAPx = baseAPy = 0
+        if prevglyph is None:   # this is new 'base'
+            xbase = xadvance
+            xOffset = xbase
+            yOffset = 0
+        else:                 	# this is 'attach'
+            if diacAP is not None: # find diacritic Attachment Point in currglyph
+                if diacAP not in cganc:
+                    logger.log("The AP '" + diacAP + "' does not exist on diacritic glyph " + currglyph, "E")
+                    complete = False
+                else:
+                    diacAPx, diacAPy = cganc[diacAP]
+            else:
+                logger.log("No AP specified for diacritic " + currglyph, "E")
+                complete = False
+            if baseAP is not None: # find base character Attachment Point in target glyph
+                if baseAP not in anchors:
+                    logger.log("The AP '" + baseAP + "' does not exist on base glyph when building " + targetglyphname, "E")
+                    complete = False
+                else:
+                    baseAPx, baseAPy = anchors[baseAP]
+                    if removeused:
+                        logger.log("Removing used anchor " + baseAP, "V")
+                        del anchors[baseAP]
+            xOffset = baseAPx - diacAPx
+            yOffset = baseAPy - diacAPy
+
+        if shiftx is not None: xOffset += int(shiftx)
+        if shifty is not None: yOffset += int(shifty)
+        components.append((currglyph, xOffset, yOffset))
+
+        # Add advance width of currglyph to xadvance
+        xadvance += cgadv
+
+        # Move anchor information to anchors, adjusted for position in target glyph
+        for thisanchorname, (x, y) in cganc.items():
+            if removeused and thisanchorname == diacAP:
+                logger.log("Skiping used anchor " + diacAP, "V")
+                continue # skip this anchor
+            anchors[thisanchorname] = (x + xOffset, y + yOffset)
+            logger.log("Adding anchor " + thisanchorname + ": " + str(anchors[thisanchorname]), "V")
+        logger.log(str(anchors),"V")
+
+    xbase = xadvance + rsb ### adjust with rsb
+    if adv is not None: xbase = adv ### if adv specified, then this advance value overrides calculated value
+
+    # Flatten components, replacing any component that has only components with those, offset by its position
+    if flatten:
+        flattened = []
+        for base, x, y in components:
+            subcomps = glyphdata[base][2]
+            if subcomps:
+                flattened.extend((b, x + x1, y + y1) for b, x1, y1 in subcomps)
+            else:
+                flattened.append((base, x, y))
+        if flattened == components:
+            logger.log("No changes to flatten components", "V")
+        else:
+            components = flattened
+            logger.log("Components flattened", "V")
+
+    return xbase, components, anchors, complete
+
+def buildorder(cdlines, logger):
+    """Given a list of (linenum, CDline, CDelement), return it reordered so that composites
+    are built after any composites they use, otherwise keeping file order.
+    Lines in a circular dependency are logged as errors and left out"""
+    defined = {} # {glyph name: [indexes of lines defining it]}
+    for i, (linenum, CDline, g) in enumerate(cdlines):
+        defined.setdefault(g.get('PSName'), []).append(i)
+    users = [[] for l in cdlines] # indexes of lines that need to be built after each line
+    waiting = [0] * len(cdlines) # number of lines each line is still waiting for
+    for i, (linenum, CDline, g) in enumerate(cdlines):
+        target = g.get('PSName')
+        deps = set()
+        for e in g.iter():
+            if e.tag in ('base', 'attach'):
+                name = e.get('PSName')
+                if name != target: deps.update(defined.get(name, []))
+        for d in deps: users[d].append(i)
+        waiting[i] = len(deps)
+    # Kahn's algorithm, taking the earliest line in the file whenever there is a choice
+    ready = [i for i in range(len(cdlines)) if waiting[i] == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        i = heapq.heappop(ready)
+        order.append(i)
+        for u in users[i]:
+            waiting[u] -= 1
+            if waiting[u] == 0: heapq.heappush(ready, u)
+    if len(order) < len(cdlines):
+        for i, (linenum, CDline, g) in enumerate(cdlines):
+            if waiting[i]:
+                logger.log("Circular dependency on line " + str(linenum+1) + ", so not building " + g.get('PSName'), "E")
+    return [cdlines[i] for i in order]
+
+def glyphfingerprint(glyph):
+    """Return a hash of the glyph data used in building composites: advance, unicodes,
+    anchors and outline components, plus the number of contours"""
+    if glyph is None: return None
+    adv = glyph['advance'].element.get('width') if glyph['advance'] is not None else None
+    unicodes = [u.element.get('hex') for u in glyph['unicode']]
+    anchors = sorted([(a.element.get('name'), a.element.get('x'), a.element.get('y')) for a in glyph['anchor']])
+    outline = glyph['outline']
+    components = contours = None
+    if outline is not None:
+        components = [(c.element.get('base'), c.element.get('xOffset'), c.element.get('yOffset')) for c in outline.components]
+        contours = len(outline.contours)
+    return hashlib.sha1(json.dumps([adv, unicodes, anchors, components, contours])).hexdigest()
 
 def doit(args) :
     global glyphlist
@@ -58,24 +202,41 @@ def doit(args) :
     r = args.report
     if r: infont.logger.loglevel = infont.logger.loglevels[r]
 
+    # cache is {CDline: {'components': fingerprint of component glyphs, 'result': fingerprint of glyph built}}
+    cache = None
+    if args.cache:
+        cache = {}
+        if os.path.exists(args.cache):
+            try:
+                with open(args.cache) as f: cache = json.load(f)
+            except ValueError:
+                infont.logger.log("Ignoring invalid cache file " + args.cache, "W")
+    newcache = {}
+    unchanged = 0
+
     ### temp section (these may someday be passed as optional parameters)
     RemoveUsedAnchors = True
     FlattenComponents = True
     ### end of temp section
 
     cgobj = CompGlyph()
+    glyphdata = GlyphData(infont.deflayer)
 
+    # Parse all lines first so each composite can be built after the composites it uses
+    cdlines = [] # list of (linenum, CDline, CDelement)
     for linenum, rawCDline in enumerate(args.cdfile):
         CDline=rawCDline.strip()
         if len(CDline) == 0 or CDline[0] == "#": continue
-        infont.logger.log("Processing line " + str(linenum+1) + ": " + CDline,"I")
         cgobj.CDline=CDline
         try:
             cgobj.parsefromCDline()
         except ValueError as mess:
-            infont.logger.log("Parsing error: " + str(mess), "E")
+            infont.logger.log("Parsing error on line " + str(linenum+1) + ": " + str(mess), "E")
             continue
-        g = cgobj.CDelement
+        cdlines.append((linenum, CDline, cgobj.CDelement))
+
+    for linenum, CDline, g in buildorder(cdlines, infont.logger):
+        infont.logger.log("Processing line " + str(linenum+1) + ": " + CDline,"I")
 
         # Collect target glyph information and construct list of component glyphs
         targetglyphname = g.get("PSName")
@@ -93,110 +254,26 @@ def doit(args) :
                 addtolist(e,None)
         infont.logger.log(str(glyphlist),"V")
 
-        # find each component glyph and compute x,y position
-        xbase = xadvance = lsb
-        ybase = 0
-        componentlist = []
-        targetglyphanchors = {} # dictionary of {name: (xOffset,yOffset)}
-        for currglyph, prevglyph, baseAP, diacAP, shiftx, shifty in glyphlist:
-            # get current glyph and its anchor names from font
-            if currglyph not in infont.deflayer:
-                infont.logger.log(currglyph + " not found in font", "E")
+        # Skip the glyph if it was built from the same line and components and has not been changed since
+        if cache is not None:
+            compprint = hashlib.sha1(json.dumps([(c[0], glyphfingerprint(infont.deflayer[c[0]]) if c[0] in infont.deflayer else None)
+                for c in glyphlist])).hexdigest()
+            entry = cache.get(CDline)
+            if entry and entry['components'] == compprint and targetglyphname in infont.deflayer and \
+                    glyphfingerprint(infont.deflayer[targetglyphname]) == entry['result']:
+                infont.logger.log("Glyph " + targetglyphname + " unchanged since last build", "V")
+                newcache[CDline] = entry
+                unchanged += 1
                 continue
-            cg = infont.deflayer[currglyph]
-            cganc = [x.element.get('name') for x in cg['anchor']]
-            diacAPx = diacAPy = 0
-            baseAPx = baseAPy = 0
-            if prevglyph is None:   # this is new 'base'
-                xbase = xadvance
-                xOffset = xbase
-                yOffset = 0
-            else:                 	# this is 'attach'
-                if diacAP is not None: # find diacritic Attachment Point in currglyph
-                    if diacAP not in cganc:
-                        infont.logger.log("The AP '" + diacAP + "' does not exist on diacritic glyph " + currglyph, "E")
-                    else:
-                        i = cganc.index(diacAP)
-                        diacAPx = int(cg['anchor'][i].element.get('x'))
-                        diacAPy = int(cg['anchor'][i].element.get('y'))
-                else:
-                    infont.logger.log("No AP specified for diacritic " + currglyph, "E")
-                if baseAP is not None: # find base character Attachment Point in targetglyph
-                    if baseAP not in targetglyphanchors.keys():
-                        infont.logger.log("The AP '" + baseAP + "' does not exist on base glyph when building " + targetglyphname, "E")
-                    else:
-                        baseAPx = targetglyphanchors[baseAP][0]
-                        baseAPy = targetglyphanchors[baseAP][1]
-                        if RemoveUsedAnchors:
-                            infont.logger.log("Removing used anchor " + baseAP, "V")
-                            del targetglyphanchors[baseAP]
-                xOffset = baseAPx - diacAPx
-                yOffset = baseAPy - diacAPy
-
-            if shiftx is not None: xOffset += int(shiftx)
-            if shifty is not None: yOffset += int(shifty)
-
-            componentdic = {'base': currglyph}
-            if xOffset != 0: componentdic['xOffset'] = str(xOffset)
-            if yOffset != 0: componentdic['yOffset'] = str(yOffset)
-            componentlist.append( componentdic )
-
-            # Find advance width of currglyph and add to xadvance
-            xadvance += int(cg['advance'].element.get('width'))
-
-            # Move anchor information to targetglyphanchors
-            for a in cg['anchor']:
-                dic = a.element.attrib
-                thisanchorname = dic['name']
-                if RemoveUsedAnchors and thisanchorname == diacAP:
-                    infont.logger.log("Skiping used anchor " + diacAP, "V")
-                    continue # skip this anchor
-                # add anchor (adjusted for position in targetglyph)
-                targetglyphanchors[thisanchorname] = ( int( dic['x'] ) + xOffset, int( dic['y'] ) + yOffset )
-                infont.logger.log("Adding anchor " + thisanchorname + ": " + str(targetglyphanchors[thisanchorname]), "V")
-            infont.logger.log(str(targetglyphanchors),"V")
-
-        xbase = xadvance + rsb ### adjust with rsb
-        if adv is not None: xbase = adv ### if adv specified, then this advance value overrides calculated value
+        xbase, componentlist, targetglyphanchors, complete = positioncomposite(glyphlist, glyphdata,
+            lsb, rsb, adv, infont.logger, targetglyphname, RemoveUsedAnchors, FlattenComponents)
 
         infont.logger.log("Glyph: " + targetglyphname + ", " + str(targetglyphunicode) + ", " + str(xbase), "V")
         for c in componentlist:
             infont.logger.log(str(c), "V")
 
-        # Flatten components
-        if FlattenComponents:
-            newcomponentlist = []
-            for compdic in componentlist:
-                c = compdic['base']
-                x = compdic.get('xOffset')
-                y = compdic.get('yOffset')
-                # look up component glyph
-                g=infont.deflayer[c]
-                # check if it has only components (that is, no contours) in outline
-                if g['outline'] and g['outline'].components and not g['outline'].contours:
-                    # for each component, get base, x1, y1 and create new entry with base, x+x1, y+y1
-                    for subcomp in g['outline'].components:
-                        b = subcomp.element.get('base')
-                        x1 = subcomp.element.get('xOffset')
-                        y1 = subcomp.element.get('yOffset')
-                        xOffset = addtwo(x, x1)
-                        yOffset = addtwo(y, y1)
-                        componentdic = {'base': b}
-                        if xOffset != 0: componentdic['xOffset'] = str(xOffset)
-                        if yOffset != 0: componentdic['yOffset'] = str(yOffset)
-                        newcomponentlist.append( componentdic )
-                else:
-                    newcomponentlist.append( compdic )
-            if componentlist == newcomponentlist:
-                infont.logger.log("No changes to flatten components", "V")
-            else:
-                componentlist = newcomponentlist
-                infont.logger.log("Components flattened", "V")
-                for c in componentlist:
-                    infont.logger.log(str(c), "V")
-
         # Check if this new glyph exists in the font already; if so, decide whether to replace, or issue warning
-        if  targetglyphname in infont.deflayer.keys():
+        if  targetglyphname in infont.deflayer:
             infont.logger.log("Target glyph, " + targetglyphname + ", already exists in font.", "V")
             g = infont.deflayer[targetglyphname]
             if g['outline'] and g['outline'].contours and not args.force: # don't replace glyph with contours, unless -f set
@@ -214,7 +291,10 @@ def doit(args) :
         if targetglyphunicode: targetglyph.add('unicode',{'hex': targetglyphunicode} )
         targetglyph.add('outline')
         # add to the outline element, a component element for every entry in componentlist
-        for compdic in componentlist:
+        for base, xOffset, yOffset in componentlist:
+            compdic = {'base': base}
+            if xOffset != 0: compdic['xOffset'] = str(xOffset)
+            if yOffset != 0: compdic['yOffset'] = str(yOffset)
             comp = Ucomponent(targetglyph['outline'],ET.Element('component',compdic))
             targetglyph['outline'].appendobject(comp,'component')
         # copy anchors to new glyph from targetglyphanchors which has {'U': (500,1000), 'L': (500,0)}
@@ -222,9 +302,17 @@ def doit(args) :
             targetglyph.add('anchor', {'name': a, 'x': str(targetglyphanchors[a][0]), 'y': str(targetglyphanchors[a][1])} )
         # actually add the glyph to the font
         infont.deflayer.addGlyph(targetglyph)
+        glyphdata.pop(targetglyphname, None) # so later composites use the new glyph
+        if cache is not None and complete:
+            newcache[CDline] = {'components': compprint, 'result': glyphfingerprint(targetglyph)}
+
+    if cache is not None:
+        infont.logger.log(str(unchanged) + " glyphs unchanged since last build", "I")
 
     # If analysis only, return without writing output font
     if args.analysis: return
+    if cache is not None:
+        with open(args.cache, "w") as f: json.dump(newcache, f, indent=0, sort_keys=True)
     # Return changed font and let execute() write it out
     return infont
 
@@ -9,41 +9,59 @@ from silfont.genlib import execute
 from silfont.genlib import ETWriter
 from silfont.complib import CompGlyph
 from xml.etree import ElementTree as ET
+import sys, collections, multiprocessing
 
 # specify three parameters: input file (single line format), output file (XML format), log file
 # and optional -p indentFirst "   " -p indentIncr "   " -p "PSName,UID,with,at,x,y" for XML formatting.
+# -j runs the parsing in that many processes; output and log are the same whatever the number.
 argspec = [
     ('input',{'help': 'Input file of CD in single line format'}, {'type': 'infile'}),
     ('output',{'help': 'Output file of CD in XML format'}, {'type': 'outfile', 'def': '_out.xml'}),
     ('log',{'help': 'Log file'},{'type': 'outfile', 'def': '_log.txt'}),
-    ('-p','--params',{'help': 'XML formatting parameters: indentFirst, indentIncr, attOrder','action': 'append'}, {'type': 'optiondict'})]
+    ('-p','--params',{'help': 'XML formatting parameters: indentFirst, indentIncr, attOrder','action': 'append'}, {'type': 'optiondict'}),
+    ('-j','--jobs',{'help': 'Number of processes to use', 'type': int, 'default': 1}, {})]
 
-def doit(args) :
-    ofile = args.output
-    lfile = args.log
-    filelinecount = 0
-    linecount = 0
-    elementcount = 0
+chunksize = 1000 # lines per chunk of work
+
+def convertchunk(chunk, indentFirst, indentIncr, attributeOrder) :
+    """Parse a list of (line number, line) and return the number of non-blank, non-comment lines
+    with a list of (line number, error message or None, serialized <glyph> or None)"""
     cgobj = CompGlyph()
     f = ET.Element('font')
-    for line in args.input.readlines():
-        filelinecount += 1
+    etwobj=ETWriter(f, indentFirst=indentFirst, indentIncr=indentIncr, attributeOrder=attributeOrder)
+    linecount = 0
+    results = []
+    for filelinecount, line in chunk :
         testline = line.strip()
-	if len(testline) > 0 and testline[0] != '#':  # not whitespace or comment
+        if len(testline) > 0 and testline[0] != '#':  # not whitespace or comment
             linecount += 1
             cgobj.CDline=line
             cgobj.CDelement=None
             try:
                 cgobj.parsefromCDline()
                 if cgobj.CDelement != None:
-                    f.append(cgobj.CDelement)
-                    elementcount += 1
+                    out = []
+                    etwobj.serialize_xml(out.append, base=cgobj.CDelement, indent=indentFirst)
+                    results.append((filelinecount, None, u"".join(out)))
             except ValueError, e:
-                lfile.write("Line "+str(filelinecount)+": "+str(e)+'\n')
-    if linecount != elementcount:
-        lfile.write("Lines read from input file: " + str(filelinecount)+'\n')
-        lfile.write("Lines parsed (excluding blank and comment lines): " + str(linecount)+'\n')
-        lfile.write("Valid glyphs found: " + str(elementcount)+'\n')
+                results.append((filelinecount, str(e), None))
+    return linecount, results
+
+def _convertchunk(args) : # for use with multiprocessing
+    return convertchunk(*args)
+
+def readchunks(infile) :
+    chunk = []
+    for filelinecount, line in enumerate(infile, 1) :
+        chunk.append((filelinecount, line))
+        if len(chunk) == chunksize :
+            yield chunk
+            chunk = []
+    if chunk : yield chunk
+
+def doit(args) :
+    ofile = args.output
+    lfile = args.log
 #   instead of simple serialization with: ofile.write(ET.tostring(f))
 #   create ETWriter object and specify indentation and attribute order to get normalized output
     indentFirst = "   "
@@ -55,8 +73,49 @@ def doit(args) :
         elif k == 'attOrder': attOrder = args.params['attOrder']
     x = attOrder.split(',')
     attributeOrder = dict(zip(x,range(len(x))))
-    etwobj=ETWriter(f, indentFirst=indentFirst, indentIncr=indentIncr, attributeOrder=attributeOrder)
-    etwobj.serialize_xml(ofile.write)
+
+    # Glyph elements are written as soon as their chunk is parsed, in input order, giving the same
+    # output as serializing a complete <font> element with ETWriter
+    def writechunk(chunkinfo) :
+        count, results = chunkinfo
+        for linenum, error, glyph in results :
+            if error is not None :
+                lfile.write("Line "+str(linenum)+": "+error+'\n')
+            else :
+                if counts[2] == 0 : ofile.write('<?xml version="1.0" encoding="UTF-8"?>\n<font>\n')
+                ofile.write(glyph)
+                counts[2] += 1
+        counts[1] += count
+
+    counts = [0, 0, 0] # lines read, lines parsed, glyphs found
+    chunks = readchunks(args.input)
+    if args.jobs > 1 and sys.platform != 'win32' :
+        pool = multiprocessing.Pool(args.jobs)
+        pending = collections.deque()
+        for chunk in chunks :
+            counts[0] = chunk[-1][0]
+            pending.append(pool.apply_async(_convertchunk, ((chunk, indentFirst, indentIncr, attributeOrder),)))
+            if len(pending) >= 2 * args.jobs : # limit the chunks held in memory
+                writechunk(pending.popleft().get())
+        while pending :
+            writechunk(pending.popleft().get())
+        pool.close()
+        pool.join()
+    else :
+        for chunk in chunks :
+            counts[0] = chunk[-1][0]
+            writechunk(convertchunk(chunk, indentFirst, indentIncr, attributeOrder))
+    filelinecount, linecount, elementcount = counts
+
+    if linecount != elementcount:
+        lfile.write("Lines read from input file: " + str(filelinecount)+'\n')
+        lfile.write("Lines parsed (excluding blank and comment lines): " + str(linecount)+'\n')
+        lfile.write("Valid glyphs found: " + str(elementcount)+'\n')
+    if elementcount :
+        ofile.write('</font>\n')
+    else :
+        etwobj=ETWriter(ET.Element('font'), indentFirst=indentFirst, indentIncr=indentIncr, attributeOrder=attributeOrder)
+        etwobj.serialize_xml(ofile.write)
     
     return
     
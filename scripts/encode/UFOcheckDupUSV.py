@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+'Check for duplicate USVs in a UFO'
+__url__ = 'http://github.com/silnrsi/pysilfont'
+__copyright__ = 'Copyright (c) 2015, SIL International  (http://www.sil.org)'
+__license__ = 'Released under the MIT License (http://opensource.org/licenses/MIT)'
+__author__ = 'David Raymond'
+__version__ = '0.0.1'
+
+from silfont.UFOlib import *
+
+argspec = [
+    ('ifont',{'help': 'Input font file'}, {'type': 'infont'}),
+    ('-o','--output',{'help': 'Output text file'}, {'type': 'outfile', 'def': 'DupUSV.txt'})]
+
+def doit(args) :
+    font = args.ifont
+    outf = args.output
+
+    # The layer maintains a codepoint index, so just report the codepoints it has more than one glyph for
+    dups = font.deflayer.duplicateUSVs()
+    for usv in sorted(dups) :
+        usvstr = "U+{0:04X}".format(usv)
+        print usvstr + ' has duplicates'
+        outf.write('%s: %s\n' % (usvstr, ', '.join(dups[usv])))
+
+    outf.close()
+    print "Done!"
+
+execute("PSFU",doit, argspec)
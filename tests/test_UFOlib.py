@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+'Tests for silfont.UFOlib'
+__url__ = 'http://github.com/silnrsi/pysilfont'
+__copyright__ = 'Copyright (c) 2015, SIL International  (http://www.sil.org)'
+__license__ = 'Released under the MIT License (http://opensource.org/licenses/MIT)'
+
+import os, random, re, shutil, StringIO, sys, tempfile, unittest
+from silfont.genlib import loggerobj
+from silfont.UFOlib import Ufont, Ucomponent
+from xml.etree import cElementTree as ET
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def readFont(name = 'test.ufo', **kwargs) :
+    return Ufont(os.path.join(datadir, name), logger = loggerobj(scrlevel = "S"), **kwargs)
+
+class Anchors(unittest.TestCase) :
+
+    def anchors(self, glyph) :
+        return [(a.element.get('name'), a.element.get('x'), a.element.get('y')) for a in glyph['anchor']]
+
+    def test_setAnchors_repeated_name(self) :
+        # The last anchor with a name wins, as when anchors are set one at a time
+        glyph = readFont().deflayer['A']
+        glyph.setAnchors([('L', '1', '2'), ('M', '3', '4'), ('L', '5', '6')])
+        self.assertEqual(self.anchors(glyph), [('U', '250', '700'), ('M', '3', '4'), ('L', '5', '6')])
+        self.assertEqual(glyph.getAnchor('L').element.get('x'), '5')
+
+    def test_setAnchors_replaces_existing(self) :
+        glyph = readFont().deflayer['A']
+        glyph.setAnchors([('U', '10', '20'), ('U', '30', '40')])
+        self.assertEqual(self.anchors(glyph), [('U', '30', '40')])
+        glyph.setAnchors([('L', '1', '2')], replace = True)
+        self.assertEqual(self.anchors(glyph), [('L', '1', '2')])
+
+class ComponentIndex(unittest.TestCase) :
+
+    def addComponent(self, glyph, base) :
+        glyph['outline'].appendobject(Ucomponent(glyph['outline'], ET.Element('component', base = base)), 'component')
+
+    def test_outline_add_remove(self) :
+        layer = readFont().deflayer
+        self.assertEqual(layer.componentUsers('A'), [])
+        glyph = layer['Aacute']
+        glyph.remove('outline')
+        glyph.add('outline')
+        self.addComponent(glyph, 'A')
+        self.addComponent(layer['Agrave'], 'A')
+        self.assertEqual(sorted(layer.componentUsers('A')), ['Aacute', 'Agrave'])
+        glyph['outline'].removeobject(glyph['outline'].components[0], 'component')
+        self.assertEqual(layer.componentUsers('A'), ['Agrave'])
+        self.addComponent(glyph, 'A')
+        glyph.remove('outline')
+        self.assertEqual(layer.componentUsers('A'), ['Agrave'])
+
+    def test_outline_added_before_index(self) :
+        # Components added before the index is built are found when it is built
+        layer = readFont().deflayer
+        glyph = layer['Aacute']
+        glyph.remove('outline')
+        glyph.add('outline')
+        self.addComponent(glyph, 'A')
+        self.assertEqual(layer.componentUsers('A'), ['Aacute'])
+        glyph.remove('outline')
+        self.assertEqual(layer.componentUsers('A'), [])
+
+    def test_rename(self) :
+        layer = readFont().deflayer
+        self.addComponent(layer['Aacute'], 'A')
+        self.assertEqual(layer.componentUsers('A'), ['Aacute'])
+        layer['Aacute'].name = 'Aacute.alt'
+        self.assertEqual(layer.componentUsers('A'), ['Aacute.alt'])
+
+class RenameGlyphs(unittest.TestCase) :
+    # A and V are swapped and o renamed, with components added to Aacute (A), W (V) and o (V)
+    mapping = {'A': 'V', 'V': 'A', 'o': 'o.alt'}
+
+    def setUp(self) :
+        self.outdir = tempfile.mkdtemp()
+        self.font = readFont()
+        self.layer = self.font.deflayer
+        for glyphn, base in (('Aacute', 'A'), ('W', 'V'), ('o', 'V')) :
+            outline = self.layer[glyphn]['outline']
+            outline.appendobject(Ucomponent(outline, ET.Element('component', base = base)), 'component')
+
+    def tearDown(self) :
+        shutil.rmtree(self.outdir)
+
+    def test_glyphs(self) :
+        (glyphA, glyphV) = (self.layer['A'], self.layer['V'])
+        self.font.renameGlyphs(self.mapping)
+        self.assertTrue(self.layer['V'] is glyphA and self.layer['A'] is glyphV)
+        self.assertEqual(sorted(self.layer.keys()), ['A', 'Aacute', 'Agrave', 'V', 'W', 'c', 'e', 'o.alt'])
+        self.assertEqual((glyphA.filen, glyphV.filen, self.layer['o.alt'].filen), ('V_.glif', 'A_.glif', 'o.alt.glif'))
+        self.assertEqual(self.layer.usvGlyphs(0x41), ['V'])
+        self.assertEqual(self.layer.componentUsers('V'), ['Aacute'])
+        self.assertEqual(sorted(self.layer.componentUsers('A')), ['W', 'o.alt'])
+
+    def test_lib(self) :
+        self.font.renameGlyphs(self.mapping)
+        self.assertEqual(self.font.lib.getnative('public.glyphOrder'), ['V', 'Aacute', 'Agrave', 'A', 'W', 'c', 'e', 'o.alt'])
+        self.assertEqual(self.font.lib.getnative('public.postscriptNames').items(), [('V', 'A'), ('o.alt', 'o'), ('A', 'V')])
+
+    def test_groups_and_kerning(self) :
+        kerning = self.font.kerningIndex()
+        flat = kerning.flatten()
+        self.font.renameGlyphs(self.mapping)
+        self.assertEqual(self.font.groups['public.kern1.V'], ['A', 'W'])
+        self.assertEqual(self.font.groups['public.kern2.o'], ['o.alt', 'e', 'c'])
+        self.assertEqual(self.font.kerning['W'], {'o.alt': -45})
+        rename = lambda glyphn : self.mapping.get(glyphn, glyphn)
+        self.assertEqual(kerning.flatten(), dict(((rename(first), rename(second)), value) for (first, second), value in flat.iteritems()))
+
+    def test_features(self) :
+        # Comments, strings, class names, lookup names and tags are left alone; escaped names keep the backslash
+        self.font.renameGlyphs(self.mapping)
+        text = self.font.features.gettext()
+        self.assertEqual(text.splitlines()[:4], ['# Kerning for A and V', 'languagesystem DFLT dflt;', '', '@caps = [V Aacute A \\W];'])
+        for line in ('@A = [V Agrave];', 'lookup A {', '    sub V by Aacute;', '} A;', '    pos V A -80;',
+                '    pos \\A V -80; # V then A', '    pos @caps o.alt -20;', '    lookup A;', '    nameid 1 "A and V";') :
+            self.assertTrue(line in text.splitlines(), line)
+
+    def test_write(self) :
+        self.font.renameGlyphs(self.mapping)
+        outufo = os.path.join(self.outdir, 'out.ufo')
+        self.font.write(outufo)
+        font = Ufont(outufo, logger = loggerobj(scrlevel = "S"))
+        glyphsdir = os.path.join(outufo, 'glyphs')
+        self.assertEqual(sorted(os.listdir(glyphsdir)), ['A_.glif', 'A_acute.glif', 'A_grave.glif', 'V_.glif', 'W_.glif', 'c.glif', 'contents.plist', 'e.glif', 'o.alt.glif'])
+        self.assertEqual(font.deflayer.contents['V'][1].text, 'V_.glif')
+        self.assertEqual(font.deflayer['V']['unicode'][0].element.get('hex'), '0041')
+        self.assertEqual(font.deflayer['Aacute']['outline'].components[0].element.get('base'), 'V')
+        self.assertTrue('sub V by Aacute;' in open(os.path.join(outufo, 'features.fea')).read())
+
+    def test_clash(self) :
+        # Nothing is renamed if a new name is already used by a glyph that is not renamed
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try :
+            self.assertRaises(SystemExit, self.font.renameGlyphs, {'A': 'W'})
+        finally :
+            sys.stdout = stdout
+        self.assertEqual(sorted(self.layer.keys()), ['A', 'Aacute', 'Agrave', 'V', 'W', 'c', 'e', 'o'])
+        self.assertTrue('sub A by Aacute;' in self.font.features.gettext())
+
+class NativePlists(unittest.TestCase) :
+    # groups.plist and kerning.plist are read as python values (see Uplist)
+
+    def setUp(self) :
+        self.outdir = tempfile.mkdtemp()
+
+    def tearDown(self) :
+        shutil.rmtree(self.outdir)
+
+    def readFile(self, dirn, filen) :
+        with open(os.path.join(dirn, filen)) as f :
+            return f.read()
+
+    def keys(self, text) :
+        return re.findall(r"<key>(.*)</key>", text)
+
+    def test_roundtrip_keeps_order(self) :
+        # With sortDicts off, keys are output in the same order as the input files
+        outufo = os.path.join(self.outdir, 'out.ufo')
+        readFont(clparams = {'sortDicts': 'False'}).write(outufo)
+        for filen in ('groups.plist', 'kerning.plist') :
+            intext = self.readFile(os.path.join(datadir, 'test.ufo'), filen)
+            outtext = self.readFile(outufo, filen)
+            self.assertNotEqual(self.keys(intext), sorted(self.keys(intext))) # So the test shows order is kept
+            self.assertEqual(self.keys(outtext), self.keys(intext))
+            self.assertEqual(outtext, intext)
+
+    def test_roundtrip_sorted(self) :
+        outufo = os.path.join(self.outdir, 'out.ufo')
+        readFont().write(outufo)
+        groups = self.keys(self.readFile(outufo, 'groups.plist'))
+        self.assertEqual(groups, sorted(groups))
+
+class CompactKerning(unittest.TestCase) :
+
+    def size(self, groups, kerning) :
+        return sum(len(seconds) for seconds in kerning.itervalues()) + sum(len(glyphs) for glyphs in groups.itervalues())
+
+    def flat(self, kerning) :
+        return dict((pair, value) for pair, value in kerning.flatten().iteritems() if value)
+
+    def compact(self, kerning) :
+        # Compact and apply the kerning, checking it is no bigger, gives the same kerning and keeps the kerning groups
+        oldgroups = dict((group, list(kerning.groups[group])) for group in kerning.groupSides())
+        oldsize = self.size(oldgroups, kerning.kerning)
+        flat = self.flat(kerning)
+        (groups, pairs) = kerning.compacted()
+        self.assertTrue(self.size(groups, pairs) <= oldsize)
+        kerning.setKerning(groups, pairs)
+        self.assertEqual(self.flat(kerning), flat)
+        for group, glyphs in oldgroups.iteritems() : self.assertEqual(kerning.groups[group], glyphs)
+        return (groups, pairs, oldsize)
+
+    def test_group_kerning_with_exceptions(self) :
+        kerning = readFont().kerningIndex()
+        before = dict((first, dict(seconds)) for first, seconds in kerning.kerning.iteritems())
+        (groups, pairs, oldsize) = self.compact(kerning)
+        self.assertEqual(self.size(groups, pairs), oldsize) # Already as compact as it can be, so it is unchanged
+        self.assertEqual(pairs, before)
+
+    def test_random_group_kerning(self) :
+        glyphs = ["g%02d" % i for i in range(40)]
+        for seed in range(20) :
+            rand = random.Random(seed)
+            kerning = readFont().kerningIndex()
+            groups = {}
+            for side in (0, 1) :
+                names = rand.sample(glyphs, 30)
+                for i in range(5) :
+                    groups[("public.kern1.", "public.kern2.")[side] + str(i)] = names[i*6:i*6+rand.randint(1, 6)]
+            pairs = {}
+            for (first, second) in set((rand.choice(groups.keys() + glyphs), rand.choice(groups.keys() + glyphs)) for i in range(150)) :
+                if not first.startswith("public.kern2.") and not second.startswith("public.kern1.") :
+                    pairs.setdefault(first, {})[second] = rand.choice((-50, -20, 0, 10))
+            kerning.setKerning(groups, pairs)
+            self.compact(kerning)
+
+    def test_ungrouped_glyphs_are_grouped(self) :
+        kerning = readFont().kerningIndex()
+        kerning.setKerning({}, dict((first, {"o": -40, "e": -40, "c": -30}) for first in ("V", "W", "A")))
+        (groups, pairs, oldsize) = self.compact(kerning)
+        self.assertEqual(groups, {"public.kern1.A": ["A", "V", "W"], "public.kern2.e": ["e", "o"]})
+        self.assertEqual(pairs, {"public.kern1.A": {"c": -30, "public.kern2.e": -40}})
+
+if __name__ == '__main__' :
+    unittest.main()
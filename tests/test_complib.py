@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'Tests for silfont.complib'
+__url__ = 'http://github.com/silnrsi/pysilfont'
+__copyright__ = 'Copyright (c) 2015, SIL International  (http://www.sil.org)'
+__license__ = 'Released under the MIT License (http://opensource.org/licenses/MIT)'
+
+import os, unittest
+from xml.etree import cElementTree as ET
+import silfont.complib as complib
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def readCDlines() :
+    with open(os.path.join(datadir, 'sample.cd')) as f :
+        return f.readlines()
+
+def regexTokens(line) :
+    # Split line with the regexes, returning the tokens with the components as a list, or the error text
+    try :
+        tokens = complib.CompGlyph(CDline = line)._splitCDlineRE()
+        if tokens : tokens = tokens[:5] + (list(tokens[5]),)
+        return tokens
+    except ValueError as e :
+        return "ValueError: " + str(e)
+
+def parseLine(line, scanner = True) :
+    # Parse line to a <glyph> element as a string, or the error text, optionally with the scanner disabled
+    saved = complib._scanCDline
+    if not scanner : complib._scanCDline = lambda line : None
+    try :
+        glyph = complib.CompGlyph(CDline = line)
+        glyph.parsefromCDline()
+        return ET.tostring(glyph.CDelement) if glyph.CDelement is not None else None
+    except ValueError as e :
+        return "ValueError: " + str(e)
+    finally :
+        complib._scanCDline = saved
+
+class CDlineParsers(unittest.TestCase) :
+    # The single-pass scanner (_scanCDline) and the regexes (_splitCDlineRE) must split lines the same way
+
+    def test_scanner_matches_regexes(self) :
+        scanned = 0
+        for line in readCDlines() :
+            tokens = complib._scanCDline(line)
+            if tokens is None : continue # Left to the regexes
+            scanned += 1
+            if tokens : tokens = tokens[:5] + (list(tokens[5]),)
+            self.assertEqual(tokens, regexTokens(line), "Different split for: " + line)
+        self.assertTrue(scanned > 0)
+
+    def test_scanner_leaves_errors_to_regexes(self) :
+        for line in readCDlines() :
+            if isinstance(regexTokens(line), basestring) :
+                self.assertEqual(complib._scanCDline(line), None, "Scanner accepted: " + line)
+
+    def test_elements_match(self) :
+        for line in readCDlines() :
+            self.assertEqual(parseLine(line), parseLine(line, scanner = False), "Different element for: " + line)
+
+if __name__ == '__main__' :
+    unittest.main()
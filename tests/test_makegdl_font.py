@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+'Tests for silfont.makegdl.font'
+__url__ = 'http://github.com/silnrsi/pysilfont'
+__copyright__ = 'Copyright (c) 2015, SIL International  (http://www.sil.org)'
+__license__ = 'Released under the MIT License (http://opensource.org/licenses/MIT)'
+
+import os, unittest
+from silfont.genlib import loggerobj
+from silfont.UFOlib import Ufont
+from silfont.makegdl.font import Font
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def ufoFont() :
+    font = Font(None)
+    font.loadUFO(Ufont(os.path.join(datadir, 'test.ufo'), logger = loggerobj(scrlevel = "S")))
+    return font
+
+class LoadAP(unittest.TestCase) :
+
+    def test_ap_only(self) :
+        font = Font(None)
+        font.loadAP(os.path.join(datadir, 'test_ap.xml'))
+        self.assertEqual([g.psname for g in font.glyphs], ['A', 'Z'])
+
+    def test_ap_merged_into_ufo(self) :
+        # AP data is added to the glyphs already loaded from the UFO rather than replacing them
+        font = ufoFont()
+        names = [g.psname for g in font.glyphs]
+        self.assertEqual(len(names), 8)
+        font.loadAP(os.path.join(datadir, 'test_ap.xml'))
+        self.assertEqual([g.psname for g in font.glyphs], names + ['Z'])
+        glyph = font.glyph('A')
+        self.assertEqual(sorted(glyph.anchors.items()), [('LS', (10, 0)), ('US', (250, 700))])
+        self.assertEqual(glyph.classes, set(['cCap']))
+        self.assertEqual(font.glyph('Z').gid, 8)
+        self.assertEqual(font.glyph('Aacute').anchors, {'US': (250, 700)})
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+'Tests for silfont.makegdl.ot'
+__url__ = 'http://github.com/silnrsi/pysilfont'
+__copyright__ = 'Copyright (c) 2015, SIL International  (http://www.sil.org)'
+__license__ = 'Released under the MIT License (http://opensource.org/licenses/MIT)'
+
+import logging, os, unittest
+from fontTools.ttLib.tables import otTables
+from fontTools.ttLib.tables.otBase import ValueRecord
+from silfont.genlib import loggerobj
+from silfont.UFOlib import Ufont
+from silfont.makegdl.font import Font
+from silfont.makegdl.ot import compress_strings
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def ufoFont() :
+    # Glyphs by gid: A Aacute Agrave V W c e o
+    font = Font(None)
+    font.loadUFO(Ufont(os.path.join(datadir, 'test.ufo'), logger = loggerobj(scrlevel = "S")))
+    return font
+
+def valueRecord(**values) :
+    v = ValueRecord()
+    for k, x in values.items() : setattr(v, k, x)
+    return v
+
+def coverage(glyphs) :
+    c = otTables.Coverage()
+    c.glyphs = glyphs
+    return c
+
+def classDef(classes) :
+    c = otTables.ClassDef()
+    c.classDefs = classes
+    return c
+
+class _Warnings(logging.Handler) :
+
+    def __init__(self) :
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record) :
+        self.messages.append(record.getMessage())
+
+class CompressStrings(unittest.TestCase) :
+
+    def test_ligatures(self) :
+        # LigatureSubst: strings are the input components, values the ligatures
+        strings = [[['f', 'i'], 'fi'], [['f', 'l'], 'fl'], [['f', 'f', 'i'], 'ffi'], [['f', 'f', 'l'], 'ffl']]
+        self.assertEqual(compress_strings(strings), [
+            [['f', ['i', 'l']], ['fi', 'fl'], 1],
+            [['f', 'f', ['i', 'l']], ['ffi', 'ffl'], 2]])
+
+    def test_ligatures_same_value(self) :
+        strings = [[['a', 'b'], 'x'], [['c', 'b'], 'x'], [['d', 'e'], 'y']]
+        self.assertEqual(compress_strings(strings), [[[['a', 'c'], 'b'], 'x', None], [['d', 'e'], 'y', None]])
+
+    def test_ligatures_repeated_input(self) :
+        # A class of input glyphs can't map one glyph to more than one ligature
+        strings = [[['x', 'p'], 'a'], [['x', 'p'], 'b'], [['y', 'p'], 'c']]
+        self.assertEqual(compress_strings(strings), [[['x', 'p'], 'a', None], [['x', 'p'], 'b', None], [['y', 'p'], 'c', None]])
+
+    def test_multiple_repeated_output(self) :
+        # MultipleSubst: strings are the output sequences, values the input glyphs, so output glyphs can repeat
+        strings = [[['x', 'p'], 'a'], [['x', 'p'], 'b'], [['y', 'p'], 'c']]
+        self.assertEqual(compress_strings(strings, matchcols = False), [[[['x', 'x', 'y'], 'p'], ['a', 'b', 'c'], 0]])
+
+    def test_multiple(self) :
+        strings = [[['a', 'acute'], 'aacute'], [['e', 'acute'], 'eacute'], [['e', 'grave'], 'egrave']]
+        self.assertEqual(compress_strings(strings, matchcols = False), [
+            [[['a', 'e'], 'acute'], ['aacute', 'eacute'], 0],
+            [['e', 'grave'], 'egrave', None]])
+
+class PairPos(unittest.TestCase) :
+
+    def setUp(self) :
+        self.font = ufoFont()
+        self.warnings = _Warnings()
+        logging.getLogger().addHandler(self.warnings)
+
+    def tearDown(self) :
+        logging.getLogger().removeHandler(self.warnings)
+
+    def classes(self) :
+        return dict((name, c.elements) for name, c in self.font.classes.items() if name.startswith('cot_'))
+
+    def test_format1(self) :
+        def pairSet(pairs) :
+            s = otTables.PairSet()
+            s.PairValueRecord = []
+            for second, value in pairs :
+                r = otTables.PairValueRecord()
+                r.SecondGlyph = second
+                r.Value1 = value
+                s.PairValueRecord.append(r)
+            return s
+        lookup = otTables.PairPos()
+        lookup.Format = 1
+        lookup.Coverage = coverage(['A', 'V'])
+        lookup.PairSet = [
+            pairSet([('V', valueRecord(XAdvance = -80)), ('W', valueRecord(XAdvance = -80)), ('o', valueRecord(XAdvance = 0))]),
+            pairSet([('A', valueRecord(XAdvance = -80)), ('o', valueRecord(XAdvance = -40))])]
+        lookup.process(self.font, "0")
+        # Pairs with the same adjustment are merged into a class and zero pairs are kept
+        self.assertEqual(self.font.posRules["0"], [
+            'g__a {advance.x+=-80;} cot_k0r0;',
+            'g__a {advance.x+=0;} g_o;',
+            'g__v {advance.x+=-80;} g__a;',
+            'g__v {advance.x+=-40;} g_o;'])
+        self.assertEqual(self.classes(), {'cot_k0r0': (3, 4)})
+        self.assertEqual(self.warnings.messages, [])
+
+    def test_format2(self) :
+        def class1Record(values) :
+            r = otTables.Class1Record()
+            r.Class2Record = []
+            for x in values :
+                c = otTables.Class2Record()
+                c.Value1 = valueRecord(XAdvance = x)
+                r.Class2Record.append(c)
+            return r
+        lookup = otTables.PairPos()
+        lookup.Format = 2
+        lookup.Coverage = coverage(['A', 'Aacute', 'V', 'W'])     # W is in class 0
+        lookup.ClassDef1 = classDef({'A': 1, 'Aacute': 1, 'V': 2})
+        lookup.ClassDef2 = classDef({'o': 1, 'e': 1, 'V': 2})
+        lookup.Class1Record = [class1Record([0, -10, -20]), class1Record([-5, -30, -80]), class1Record([0, -40, 0, -7])]
+        lookup.process(self.font, "1")
+        # Second class 0 is skipped, with a warning if it has any adjustment, as is a class not in ClassDef2
+        self.assertEqual(self.font.posRules["1"], [
+            'g__w {advance.x+=-10;} cot_k1r1;',
+            'g__w {advance.x+=-20;} g__v;',
+            'cot_k1l1 {advance.x+=-30;} cot_k1r1;',
+            'cot_k1l1 {advance.x+=-80;} g__v;',
+            'g__v {advance.x+=-40;} cot_k1r1;',
+            'g__v {advance.x+=0;} g__v;'])
+        self.assertEqual(self.classes(), {'cot_k1l1': (0, 1), 'cot_k1r1': (6, 7)})
+        self.assertEqual(self.warnings.messages, [
+            'No processing of class 0 kerning in 1 for class 1',
+            'Second class 3 is out of range for ClassDef2 in 1 for class 2'])
+
+if __name__ == '__main__' :
+    unittest.main()